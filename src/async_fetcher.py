@@ -0,0 +1,236 @@
+import aiohttp
+import asyncio
+import codecs
+import contextlib
+import logging
+
+from .job_info import CHUNK_SIZE, BuildInfo, BuildInfoFetcher, BuildNotFoundException
+from .transport import RETRY_STATUSES
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBuildInfoFetcher(BuildInfoFetcher):
+    """Fetch build trees on an asyncio event loop.
+
+    The content of each build (JSON, console log) is downloaded with aiohttp
+    and handed over to the regular BuildInfo parsing, so the resulting
+    objects are the same as with BuildInfoFetcher.
+
+    async with AsyncBuildInfoFetcher(url) as fetcher:
+        build = await fetcher.get_build(job, number)
+    """
+
+    def __init__(
+        self,
+        url,
+        cache=None,
+        info_class=BuildInfo,
+        fetch_sections=True,
+        concurrency=16,
+        timeout=30.0,
+        session=None,
+        cache_ttl=5 * 60 * 60,
+        transport=None,
+    ):
+        super(AsyncBuildInfoFetcher, self).__init__(
+            url,
+            cache=cache,
+            info_class=info_class,
+            fetch_sections=fetch_sections,
+            cache_ttl=cache_ttl,
+            transport=transport,
+        )
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+
+        self.session = session
+        self._own_session = session is None
+        self._semaphore = None
+        self._tasks = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None and self._own_session:
+            await self.session.close()
+            self.session = None
+
+    def __get_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit_per_host=self.concurrency)
+            self.session = aiohttp.ClientSession(
+                connector=connector, headers=self.transport.headers
+            )
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self.session
+
+    # GET retried as by the transport, on 5xx and connection errors
+    @contextlib.asynccontextmanager
+    async def __get(self, url, headers=None):
+        session = self.__get_session()
+
+        attempt = 0
+        while True:
+            try:
+                response = await session.get(url, headers=headers, timeout=self.timeout)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as ex:
+                if attempt >= self.transport.retries:
+                    raise
+                logger.warning("Retrying '%s' after error: %s", url, ex)
+            else:
+                if (
+                    response.status not in RETRY_STATUSES
+                    or attempt >= self.transport.retries
+                ):
+                    break
+                response.release()
+                logger.warning("Retrying '%s' after status %d", url, response.status)
+
+            await asyncio.sleep(self.transport.get_backoff(attempt))
+            attempt += 1
+
+        try:
+            yield response
+        finally:
+            response.release()
+
+    async def get_build(
+        self, job_name, build_number, fetch=True, fetch_sections=None, fatal=False
+    ):
+        if not fetch:
+            return self.lookup_build(job_name, build_number, fetch_sections)
+
+        build_id = "%s #%s" % (job_name, build_number)
+        build = self.builds.get(build_id)
+        if build is not None:
+            return build
+
+        build = self._create_build(job_name, build_number)
+        await self.fetch_tree(build, fatal=fatal)
+
+        self.builds[build_id] = build
+        return build
+
+    async def fetch(self, job_name, build_number, fatal=False):
+        return await self.get_build(job_name, build_number, fatal=fatal)
+
+    async def _preload(self, build, extra, encoding="ISO-8859-1"):
+        if build._get_cached(build._cache_key(extra)) is not None:
+            return
+
+        if build._is_not_found(extra):
+            build._preloaded[extra] = BuildNotFoundException(build)
+            return
+
+        self.__get_session()
+        api_url = build.build_url(extra)
+
+        validators = build._get_validators(extra)
+        headers = build._get_conditional_headers(validators)
+
+        async with self._semaphore:
+            logger.info("Fetching info from '%s'", api_url)
+            async with self.__get(api_url, headers=headers) as response:
+                if response.status == 304 and validators:
+                    logger.info("Content for '%s' not modified", api_url)
+                    build._preloaded[extra] = validators["data"]
+                    return
+                if response.status == 404:
+                    build._set_not_found(extra)
+                if response.status != 200:
+                    build._preloaded[extra] = BuildNotFoundException(build)
+                    return
+                build._read_log_headers(response.headers)
+                data = await response.read()
+
+        raw_data = data.decode(encoding)
+        build._set_validators(extra, response.headers, raw_data)
+        build._preloaded[extra] = raw_data
+
+    # Parse the console log while it is being received
+    async def _stream_log(self, build, encoding="ISO-8859-1"):
+        if build._load_log_summary():
+            return
+
+        extra = build.console_log_url_extra
+        cache_key = build._cache_key(extra)
+        if build._console_log or (cache_key and self.cache.get(cache_key)):
+            # Parsed from there by BuildInfo
+            return
+
+        if build._is_not_found(extra):
+            raise BuildNotFoundException(build)
+
+        self.__get_session()
+        api_url = build.build_url(extra)
+
+        parser = build._get_log_parser()
+        decoder = codecs.getincrementaldecoder(encoding)()
+
+        async with self._semaphore:
+            logger.info("Streaming info from '%s'", api_url)
+            async with self.__get(api_url) as response:
+                if response.status == 404:
+                    build._set_not_found(extra)
+                if response.status != 200:
+                    raise BuildNotFoundException(build)
+                build._read_log_headers(response.headers)
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    parser.feed(decoder.decode(chunk))
+
+        parser.feed(decoder.decode(b"", final=True))
+        build._end_log_parsing()
+        build._save_log_summary()
+
+    async def _fetch_build(self, build, fatal=False):
+        if not build.virtual:
+            await self._preload(build, build.json_url_extra)
+        build._fetch_info(fatal)
+
+        if build._needs_log_parsing():
+            await self._stream_log(build)
+
+        # Other contents, e.g. of the Pipeline REST API, are downloaded here
+        # rather than by blocking requests of _fetch_content()
+        missing = build._get_missing_contents()
+        while missing:
+            await asyncio.gather(*(self._preload(build, extra) for extra in missing))
+            missing = build._get_missing_contents()
+        build._fetch_content()
+
+    async def __fetch_sub_build(self, build):
+        try:
+            await self._fetch_build(build)
+        except BuildNotFoundException as ex:
+            logger.warning(ex)
+
+    def fetch_sub_build(self, build):
+        if build in self._scheduled:
+            return
+        self._scheduled.add(build)
+
+        # Called while parsing the log of the upstream build, from within the loop
+        self._tasks.append(asyncio.ensure_future(self.__fetch_sub_build(build)))
+
+    async def fetch_tree(self, build, fatal=False):
+        self._scheduled.add(build)
+
+        tasks = []
+        try:
+            await self._fetch_build(build, fatal=fatal)
+            while self._tasks:
+                tasks = self._tasks
+                self._tasks = []
+                await asyncio.gather(*tasks)
+        except BaseException:
+            # Cancelled, timed out or failed: do not leave fetches behind
+            for task in tasks + self._tasks:
+                task.cancel()
+            self._tasks = []
+            raise
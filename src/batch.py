@@ -0,0 +1,145 @@
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .critical_path import CriticalPath
+from .job_info import BuildNotFoundException
+from .snapshot import load_snapshot, save_snapshot
+from .svg_printer import SvgPrinter
+
+logger = logging.getLogger(__name__)
+
+# Build numbers like '1200-1400' or '1,5,10-12'
+BUILD_RANGE_PATTERN = re.compile(r"^\d+(-\d+)?(,\d+(-\d+)?)*$")
+
+
+def is_build_range(spec):
+    return not spec.isdigit() and BUILD_RANGE_PATTERN.match(spec) is not None
+
+
+def parse_build_range(spec):
+    build_numbers = []
+    for part in spec.split(","):
+        first, _, last = part.partition("-")
+        build_numbers += [str(n) for n in range(int(first), int(last or first) + 1)]
+    return build_numbers
+
+
+# Builds listed in a file, one '<job> <build>' per line, the build being a
+# number, a range or a permalink. Empty lines and '#' comments are ignored.
+def read_build_list(path):
+    builds = []
+    with open(path) as build_list:
+        for line_number, line in enumerate(build_list, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+
+            fields = line.rsplit(None, 1)
+            if len(fields) != 2:
+                raise ValueError(
+                    "%s:%d: expected '<job> <build>', got '%s'"
+                    % (path, line_number, line)
+                )
+            job_name, build_number = fields
+            if is_build_range(build_number):
+                builds += [(job_name, n) for n in parse_build_range(build_number)]
+            else:
+                builds.append((job_name, build_number))
+    return builds
+
+
+# Fields of the templates of the output paths
+def get_path_fields(job_name, build_number):
+    return {"job": job_name.replace("/", "_"), "build": build_number}
+
+
+# Run in the worker processes. printer_options are attributes of the
+# SvgPrinter, e.g. {"index_mode": "compact"}.
+def render_snapshot(
+    snapshot_path, output, printer_options=None, critical_path_report=None
+):
+    build_info = load_snapshot(snapshot_path)
+
+    printer = SvgPrinter(build_info)
+    for name, value in (printer_options or {}).items():
+        setattr(printer, name, value)
+    if critical_path_report:
+        printer.critical_path = CriticalPath(build_info)
+        printer.critical_path.write(critical_path_report)
+    printer.print(output)
+    return output
+
+
+# Fetch builds with a single fetcher, so that they share its cache and the
+# sub-builds they have in common, and render them in a pool of processes.
+#
+# The builds are fetched one after the other (their sub-builds concurrently,
+# depending on the fetcher), each being handed over to the pool as a snapshot
+# as soon as it is fetched. output, snapshot and critical_path_report are
+# templates of paths, e.g. 'out/{job}-{build}.svg'. Returns the builds that
+# could not be fetched or rendered.
+def run_batch(
+    fetcher,
+    builds,
+    output,
+    snapshot=None,
+    processes=None,
+    printer_options=None,
+    critical_path_report=None,
+):
+    failed = []
+    tmp_dir = tempfile.mkdtemp(prefix="jenkins-build-analyzer-")
+
+    # The fetcher runs threads: do not fork the process
+    context = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+            futures = {}
+            for job_name, build_number in builds:
+                fields = get_path_fields(job_name, build_number)
+                try:
+                    build_info = fetcher.get_build(
+                        job_name, build_number, fetch_sections=True
+                    )
+                except BuildNotFoundException as ex:
+                    logger.warning(ex)
+                    failed.append((job_name, build_number))
+                    continue
+                except Exception:
+                    # e.g. Jenkins still unreachable after the retries
+                    logger.exception("Unable to fetch %s #%s", job_name, build_number)
+                    failed.append((job_name, build_number))
+                    continue
+
+                snapshot_path = os.path.join(tmp_dir, "%d.snapshot" % len(futures))
+                if snapshot:
+                    snapshot_path = snapshot.format(**fields)
+                save_snapshot(build_info, snapshot_path)
+
+                report_path = None
+                if critical_path_report:
+                    report_path = critical_path_report.format(**fields)
+                future = pool.submit(
+                    render_snapshot,
+                    snapshot_path,
+                    output.format(**fields),
+                    printer_options,
+                    report_path,
+                )
+                futures[future] = (job_name, build_number)
+
+            for future in as_completed(futures):
+                try:
+                    logger.info("Rendered '%s'", future.result())
+                except Exception:
+                    logger.exception("Unable to render %s #%s", *futures[future])
+                    failed.append(futures[future])
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return failed
@@ -0,0 +1,279 @@
+import contextlib
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Rough size in memory of decoded JSON
+def approximate_size(obj):
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += approximate_size(key) + approximate_size(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            size += approximate_size(value)
+    return size
+
+
+# On-disk cache for BuildInfo, which can be shared by several processes.
+#
+# Values are strings, stored compressed. Entries without TTL never expire and
+# the least recently used entries are evicted once the total size of the values
+# exceeds max_size (in bytes). The last access to an entry is only recorded
+# every access_interval seconds, so that reading it does not write each time.
+class SqliteCache:
+    access_interval = 60.0
+
+    def __init__(self, path, max_size=1024 * 1024 * 1024, lock_timeout=120.0):
+        self.path = path
+        self.max_size = max_size
+        # Time after which the lock of a process that died is ignored
+        self.lock_timeout = lock_timeout
+
+        self.__local = threading.local()
+        self.__owner = uuid.uuid4().hex
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        with self.__transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " expires REAL,"
+                " accessed REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS locks ("
+                " key TEXT PRIMARY KEY,"
+                " owner TEXT NOT NULL,"
+                " expires REAL NOT NULL)"
+            )
+
+    # sqlite3 connections cannot be shared between threads
+    def __connection(self):
+        db = getattr(self.__local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=60.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.__local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def __transaction(self):
+        db = self.__connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def get(self, key):
+        db = self.__connection()
+        row = db.execute(
+            "SELECT value, expires, accessed FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        data, expires, accessed = row
+        now = time.time()
+        if expires is not None and expires < now:
+            self.delete(key)
+            return None
+
+        try:
+            value = zlib.decompress(data).decode("utf-8")
+        except (zlib.error, UnicodeDecodeError):
+            # Written by a previous version of the cache
+            self.delete(key)
+            return None
+
+        if accessed < now - self.access_interval:
+            # A single statement, committed on its own
+            db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+
+        return value
+
+    def set(self, key, value, ttl=None):
+        data = zlib.compress(value.encode("utf-8"))
+        if len(data) > self.max_size:
+            logger.warning("Not caching '%s': %d bytes", key, len(data))
+            return
+
+        now = time.time()
+        expires = None
+        if ttl is not None:
+            expires = now + ttl
+
+        with self.__transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, expires, accessed)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), expires, now),
+            )
+            self.__evict(db, now)
+
+    def delete(self, key):
+        with self.__transaction() as db:
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def __evict(self, db, now):
+        db.execute("DELETE FROM entries WHERE expires < ?", (now,))
+
+        (total,) = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total <= self.max_size:
+            return
+
+        evicted = []
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            evicted.append((key,))
+            total -= size
+            if total <= self.max_size:
+                break
+
+        logger.debug("Evicting %d entries from the cache", len(evicted))
+        db.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+    # Held while fetching the content of a key, so that concurrent processes
+    # wait for it to be cached instead of fetching it too.
+    @contextlib.contextmanager
+    def lock(self, key, timeout=None):
+        if timeout is None:
+            timeout = self.lock_timeout
+        deadline = time.time() + timeout
+
+        acquired = False
+        while True:
+            now = time.time()
+            with self.__transaction() as db:
+                db.execute(
+                    "DELETE FROM locks WHERE key = ? AND expires < ?", (key, now)
+                )
+                cursor = db.execute(
+                    "INSERT OR IGNORE INTO locks (key, owner, expires)"
+                    " VALUES (?, ?, ?)",
+                    (key, self.__owner, now + self.lock_timeout),
+                )
+                acquired = cursor.rowcount == 1
+            if acquired or now > deadline:
+                break
+            time.sleep(0.1)
+
+        if not acquired:
+            logger.warning("Unable to lock '%s', proceeding anyway", key)
+
+        try:
+            yield
+        finally:
+            if acquired:
+                with self.__transaction() as db:
+                    db.execute(
+                        "DELETE FROM locks WHERE key = ? AND owner = ?",
+                        (key, self.__owner),
+                    )
+
+
+# In-process LRU cache of decoded content (build JSON, sections, sub-builds),
+# in front of an optional cache backend. Hot builds then cost no decoding.
+#
+# The raw content goes to the backend, only the decoded objects are kept in
+# memory, up to about max_size bytes. Decoded objects are shared: they must not
+# be modified.
+class MemoryCache:
+    def __init__(self, backend=None, max_size=256 * 1024 * 1024):
+        self.backend = backend
+        self.max_size = max_size
+        self.size = 0
+
+        # key -> (value, size, expires)
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        return self.backend.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.__drop(key)
+        if self.backend is not None:
+            self.backend.set(key, value, ttl)
+
+    def delete(self, key):
+        self.__drop(key)
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def lock(self, key):
+        if hasattr(self.backend, "lock"):
+            return self.backend.lock(key)
+        return contextlib.nullcontext()
+
+    def get_decoded(self, key, decode):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                value, size, expires = entry
+                if expires is None or expires > time.time():
+                    self.__entries.move_to_end(key)
+                    return value
+                del self.__entries[key]
+                self.size -= size
+
+        raw_data = self.get(key)
+        if not raw_data:
+            return None
+
+        value = decode(raw_data)
+        self.__store(key, value, None)
+        return value
+
+    def set_decoded(self, key, raw_data, value, ttl=None):
+        if self.backend is not None:
+            self.backend.set(key, raw_data, ttl)
+        self.__store(key, value, ttl)
+
+    def __drop(self, key):
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def __store(self, key, value, ttl):
+        size = approximate_size(value)
+        if size > self.max_size:
+            return
+
+        expires = None
+        if ttl is not None:
+            expires = time.time() + ttl
+
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+            self.__entries[key] = (value, size, expires)
+            self.size += size
+
+            while self.size > self.max_size:
+                _, (_, evicted_size, _) = self.__entries.popitem(last=False)
+                self.size -= evicted_size
@@ -0,0 +1,239 @@
+import json
+import logging
+from bisect import bisect_left, bisect_right
+
+from .job_info import NO_TIME, get_human_time
+
+logger = logging.getLogger(__name__)
+
+
+# Something that takes time in a build tree: a build, waiting in the queue
+# then running, or a section of a freestyle build. Its children are the
+# sub-builds of a build, or the sections it contains.
+class PathNode:
+    __slots__ = (
+        "build",
+        "section",
+        "wait_start",
+        "start",
+        "end",
+        "children",
+        "by_end",
+        "ends",
+        "wait_starts",
+        "slack",
+    )
+
+    def __init__(self, build, section, wait_start, start, end):
+        self.build = build
+        self.section = section
+        self.wait_start = wait_start
+        self.start = start
+        self.end = end
+        self.children = []
+        self.slack = None
+
+    # Sort the children once, so that the walks only bisect them
+    def index(self):
+        self.by_end = sorted(self.children, key=lambda child: child.end)
+        self.ends = [child.end for child in self.by_end]
+        self.wait_starts = sorted(child.wait_start for child in self.children)
+
+
+# Part of the critical path: 'queue' and 'run' of a build, or 'section'
+class PathSegment:
+    __slots__ = ("kind", "build", "section", "start", "end")
+
+    def __init__(self, kind, build, section, start, end):
+        self.kind = kind
+        self.build = build
+        self.section = section
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        info = "%s %s #%s" % (self.kind, self.build.job_name, self.build.build_number)
+        if self.section is not None:
+            info += " %s" % self.section.name
+        return "%s %s" % (info, get_human_time(self.duration))
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+# Chain of waits and executions that determined the end of a build, its
+# sub-builds included, and slack of each build: how much later it could have
+# ended without delaying the end of the top build.
+#
+# The path is walked back from the end of the top build: in each build, the
+# child that ended last before the current time is what the build waited for,
+# and the walk goes on from when that child was queued. Time not covered by a
+# child is the own execution of the build. The slack of a child is the time
+# between its end and the end of the last child its parent waited for before
+# going on, plus the slack of its parent.
+#
+# Children are sorted once per node and then bisected: O(n log n) overall.
+class CriticalPath:
+    def __init__(self, build_info):
+        self.build_info = build_info
+
+        self.segments = []
+        self.slack = {}
+
+        self.__root = self.__create_build_node(build_info, build_info.start or 0)
+        time = self.__walk(self.__root, self.__root.end)
+        if self.__root.wait_start < time:
+            self.__add_segment("queue", self.__root, self.__root.wait_start, time)
+        self.segments.reverse()
+
+        self.__compute_slack()
+
+    # Builds on the path, in the order they are first on it
+    @property
+    def builds(self):
+        builds = {}
+        for segment in self.segments:
+            builds.setdefault(segment.build, None)
+        return list(builds)
+
+    def __create_build_node(self, build, parent_start):
+        start = build.start or parent_start
+        queueing_duration = build.queueing_duration or 0
+        end = start + (build.duration or 0)
+        node = PathNode(build, None, start - queueing_duration, start, end)
+
+        if build.job_type == "freestyle" and build.sections:
+            self.__add_section_nodes(node, build.sections)
+
+        for sub_build in build.sub_builds:
+            node.children.append(self.__create_build_node(sub_build, start))
+
+        node.index()
+        return node
+
+    def __add_section_nodes(self, build_node, sections):
+        # Node of each section, or of its closest parent with timestamps
+        owners = []
+        section_nodes = []
+        for index, parent in enumerate(sections.parent):
+            owner = build_node if parent < 0 else owners[parent]
+
+            start = sections.start[index]
+            end = sections.end[index]
+            if start <= 0 or end == NO_TIME or end < start:
+                owners.append(owner)
+                continue
+
+            node = PathNode(build_node.build, sections[index], start, start, end)
+            owner.children.append(node)
+            owners.append(node)
+            section_nodes.append(node)
+
+        for node in section_nodes:
+            node.index()
+
+    def __add_segment(self, kind, node, start, end):
+        segment = PathSegment(kind, node.build, node.section, start, end)
+        self.segments.append(segment)
+
+    # Add the segments of a node up to time, last first, and return the time
+    # the walk went back to
+    def __walk(self, node, time):
+        kind = "run" if node.section is None else "section"
+
+        time = min(time, node.end)
+        last = len(node.by_end)
+        while time > node.start:
+            last = bisect_right(node.ends, time, 0, last) - 1
+            if last < 0:
+                break
+
+            child = node.by_end[last]
+            if child.end <= node.start:
+                break
+            if child.end < time:
+                self.__add_segment(kind, node, child.end, time)
+
+            # Children of the child may have been queued before it started
+            time = self.__walk(child, child.end)
+            if child.wait_start < time:
+                self.__add_segment("queue", child, child.wait_start, time)
+                time = child.wait_start
+
+        if time > node.start:
+            self.__add_segment(kind, node, node.start, time)
+            time = node.start
+        return time
+
+    def __compute_slack(self):
+        self.__root.slack = 0
+        nodes = [self.__root]
+        while nodes:
+            node = nodes.pop()
+            if node.section is None:
+                self.slack[node.build] = node.slack
+
+            for child in node.children:
+                # The next time the parent went on without this child
+                next_start = bisect_left(node.wait_starts, child.end)
+                resume = node.end
+                if next_start < len(node.wait_starts):
+                    resume = min(resume, node.wait_starts[next_start])
+
+                waited_end = child.end
+                last = bisect_right(node.ends, resume) - 1
+                if last >= 0:
+                    waited_end = max(waited_end, node.ends[last])
+
+                child.slack = node.slack + waited_end - child.end
+                nodes.append(child)
+
+    def to_dict(self):
+        path = []
+        for segment in self.segments:
+            path.append(
+                {
+                    "kind": segment.kind,
+                    "job": segment.build.job_name,
+                    "build": segment.build.build_number,
+                    "section": segment.section.name if segment.section else None,
+                    "start": segment.start,
+                    "end": segment.end,
+                    "duration": segment.duration,
+                }
+            )
+
+        critical_builds = set(self.builds)
+        builds = []
+        for build in self.build_info.all_builds:
+            builds.append(
+                {
+                    "job": build.job_name,
+                    "build": build.build_number,
+                    "stage": build.stage,
+                    "critical": build in critical_builds,
+                    "slack": self.slack.get(build),
+                }
+            )
+
+        totals = {}
+        for segment in self.segments:
+            totals[segment.kind] = totals.get(segment.kind, 0) + segment.duration
+
+        return {
+            "job": self.build_info.job_name,
+            "build": self.build_info.build_number,
+            "duration": sum(totals.values()),
+            "totals": totals,
+            "path": path,
+            "builds": builds,
+        }
+
+    def write(self, output):
+        with open(output, "w") as f_output:
+            json.dump(self.to_dict(), f_output, indent=2)
+
+        logger.info(
+            "Critical path of %d segment(s) written to '%s'", len(self.segments), output
+        )
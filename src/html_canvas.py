@@ -0,0 +1,487 @@
+import json
+
+from .layout import LayoutText
+from .raster import parse_color, parse_styles
+from .svg_writer import open_output
+
+CANVAS_HTML_TMPL = """<!DOCTYPE html>
+<html>
+<head>
+    <title>%s</title>
+    <meta charset="UTF-8">
+    <style type="text/css">
+        body {
+            margin: 0;
+        }
+        #timeline {
+            position: fixed;
+            top: 0;
+            left: 0;
+        }
+        .tooltip {
+            display: none;
+            position: absolute;
+            min-width: 300px;
+            border: 1px solid rgba(50, 50, 50, .8);
+            border-radius: 3px;
+            background: rgba(50, 50, 50, .7);
+            color: white;
+            font-family: "Arial";
+            font-size: small;
+            padding: 5px;
+        }
+        .description {
+            padding: 4px;
+            padding-left: 6px;
+            background: rgba(50, 50, 50, .2);
+            border-radius: 3px;
+            margin: 2px;
+        }
+        .description a {
+            color: white;
+        }
+        .failure-cause {
+            padding: 4px;
+            padding-left: 6px;
+            background: rgba(50, 50, 50, .2);
+            border-radius: 3px;
+            margin: 2px;
+            margin-left: 6px;
+            border-left: 2px solid #eee;
+            font-family: monospace;
+        }
+        .sections {
+            padding: 4px;
+            padding-left: 6px;
+            background: rgba(50, 50, 50, .2);
+            border-radius: 3px;
+            margin: 2px;
+            margin-left: 6px;
+            border-left: 2px solid #eee;
+            font-family: monospace;
+        }
+        .sections .error {
+            color: #ffbfbf;
+            font-weight: 700;
+        }
+        .sections .short {
+            opacity: 0.5;
+        }
+    </style>
+</head>
+<body>
+    <div result="%s">
+        <canvas id="timeline"></canvas>
+        <div id="spacer"></div>
+        <div class="tooltip" id="tooltip"></div>
+    </div>
+    <script type="application/json" id="data">%s</script>
+    <script type="text/javascript">
+    (function() {
+        var data = JSON.parse(document.getElementById("data").textContent);
+        var canvas = document.getElementById("timeline");
+        var context = canvas.getContext("2d");
+        var tooltip = document.getElementById("tooltip");
+        var spacer = document.getElementById("spacer");
+        spacer.style.width = data.width + "px";
+        spacer.style.height = data.height + "px";
+
+        // Items by cell of CELL px, for the items in a view or at a point
+        var CELL = 256;
+        function SpatialIndex() {
+            this.cells = new Map();
+        }
+        SpatialIndex.prototype.add = function(item, x, y, width, height) {
+            var firstCol = Math.max(0, Math.floor(x / CELL));
+            var firstRow = Math.max(0, Math.floor(y / CELL));
+            var lastCol = Math.floor((x + Math.max(width, 0)) / CELL);
+            var lastRow = Math.floor((y + Math.max(height, 0)) / CELL);
+            for (var col = firstCol; col <= lastCol; col++) {
+                for (var row = firstRow; row <= lastRow; row++) {
+                    var key = col * 1048576 + row;
+                    var cell = this.cells.get(key);
+                    if (cell === undefined) {
+                        this.cells.set(key, [item]);
+                    } else {
+                        cell.push(item);
+                    }
+                }
+            }
+        };
+        // Items of the cells of a view, in the order they were added
+        SpatialIndex.prototype.query = function(x, y, width, height) {
+            var items = new Set();
+            var firstCol = Math.max(0, Math.floor(x / CELL));
+            var firstRow = Math.max(0, Math.floor(y / CELL));
+            var lastCol = Math.floor((x + width) / CELL);
+            var lastRow = Math.floor((y + height) / CELL);
+            for (var col = firstCol; col <= lastCol; col++) {
+                for (var row = firstRow; row <= lastRow; row++) {
+                    var cell = this.cells.get(col * 1048576 + row);
+                    if (cell !== undefined) {
+                        cell.forEach(function(item) { items.add(item); });
+                    }
+                }
+            }
+            return Array.from(items).sort(function(a, b) { return a - b; });
+        };
+
+        // Shapes are [x, y, width, height, class] rects or [x, y, class, text]
+        // labels, whose width is estimated
+        var shapes = new SpatialIndex();
+        data.shapes.forEach(function(shape, i) {
+            if (shape.length === 5) {
+                shapes.add(i, shape[0], shape[1], shape[2], shape[3]);
+            } else {
+                var style = data.styles[shape[2]];
+                var width = shape[3].length * style.size * 0.65;
+                var x = style.align === "right" ? shape[0] - width : shape[0];
+                shapes.add(i, x, shape[1] - style.size, width, style.size);
+            }
+        });
+        var builds = new SpatialIndex();
+        data.builds.forEach(function(build, i) {
+            builds.add(i, build.area[0], build.area[1], build.area[2], build.area[3]);
+        });
+
+        function drawRect(x, y, width, height, style) {
+            if (width <= 0 || height <= 0) {
+                return;
+            }
+            if (style.fill) {
+                context.fillStyle = style.fill;
+                context.fillRect(x, y, width, height);
+            }
+            if (style.stroke) {
+                context.strokeStyle = style.stroke;
+                context.lineWidth = style.width;
+                context.strokeRect(x, y, width, height);
+            }
+        }
+
+        function drawText(text, x, y, style) {
+            context.font = style.font;
+            context.textAlign = style.align;
+            context.fillStyle = style.fill || "rgb(0,0,0)";
+            context.fillText(text, x, y);
+        }
+
+        function drawGrid(grid, viewX, viewWidth) {
+            drawRect(grid.x, grid.y, grid.width, grid.height, data.styles[grid.box]);
+            grid.levels.forEach(function(level) {
+                var style = data.styles[level[0]];
+                if (!style.stroke) {
+                    return;
+                }
+                var first = Math.ceil((viewX - 2 - grid.x) / level[1]);
+                var last = Math.floor((viewX + viewWidth + 2 - grid.x) / level[1]);
+                first = Math.max(0, first);
+                last = Math.min(level[2] - 1, last);
+                context.strokeStyle = style.stroke;
+                context.lineWidth = style.width;
+                context.beginPath();
+                for (var i = first; i <= last; i++) {
+                    var x = grid.x + i * level[1];
+                    context.moveTo(x, grid.y);
+                    context.lineTo(x, grid.y + grid.height);
+                }
+                context.stroke();
+            });
+            grid.labels.forEach(function(label) {
+                if (viewX - 100 <= label[0] && label[0] <= viewX + viewWidth) {
+                    drawText(label[3], label[0], label[1], data.styles[label[2]]);
+                }
+            });
+        }
+
+        var hovered = null;
+        var pending = false;
+
+        // Only the shapes in the window are drawn, at the scroll position
+        function draw() {
+            pending = false;
+            var ratio = window.devicePixelRatio || 1;
+            var width = document.documentElement.clientWidth;
+            var height = document.documentElement.clientHeight;
+            var canvasWidth = Math.round(width * ratio);
+            var canvasHeight = Math.round(height * ratio);
+            if (canvas.width !== canvasWidth || canvas.height !== canvasHeight) {
+                canvas.width = canvasWidth;
+                canvas.height = canvasHeight;
+                canvas.style.width = width + "px";
+                canvas.style.height = height + "px";
+            }
+
+            var viewX = window.scrollX, viewY = window.scrollY;
+            context.setTransform(ratio, 0, 0, ratio, -viewX * ratio, -viewY * ratio);
+            drawRect(viewX, viewY, width, height, data.styles[data.background]);
+            drawGrid(data.grid, viewX, width);
+
+            shapes.query(viewX, viewY, width, height).forEach(function(i) {
+                var shape = data.shapes[i];
+                if (shape.length === 5) {
+                    var style = data.styles[shape[4]];
+                    drawRect(shape[0], shape[1], shape[2], shape[3], style);
+                } else {
+                    drawText(shape[3], shape[0], shape[1], data.styles[shape[2]]);
+                }
+            });
+
+            if (hovered !== null) {
+                var area = data.builds[hovered].area;
+                context.fillStyle = "rgba(0,0,0,0.1)";
+                context.fillRect(area[0], area[1], area[2], area[3]);
+            }
+        }
+
+        function redraw() {
+            if (!pending) {
+                pending = true;
+                window.requestAnimationFrame(draw);
+            }
+        }
+
+        // Last build drawn at a point of the timeline
+        function findBuild(x, y) {
+            var found = null;
+            builds.query(x, y, 0, 0).forEach(function(i) {
+                var area = data.builds[i].area;
+                if (area[0] <= x && x <= area[0] + area[2]
+                        && area[1] <= y && y <= area[1] + area[3]) {
+                    found = i;
+                }
+            });
+            return found;
+        }
+
+        function escapeHtml(text) {
+            var div = document.createElement("div");
+            div.textContent = text;
+            return div.innerHTML;
+        }
+
+        function getTooltip(build) {
+            var lines = [];
+            if (build.name) {
+                lines.push("<b>Build:</b> " + escapeHtml(build.name) + "<br/>");
+            }
+            lines.push("<b>Queue Time:</b> " + build.queue + "<br/>");
+            lines.push("<b>Exec Time:</b> " + build.exec + "<br/>");
+            lines.push("<b>Result:</b> " + build.result + "<br/>");
+            if (build.slack) {
+                lines.push("<b>Slack:</b> " + build.slack + "<br/>");
+            }
+            if (build.description) {
+                lines.push('<b>Description:</b><br/><div class="description">'
+                           + build.description + "</div>");
+            }
+            if (build.causes) {
+                lines.push("<b>Failure Causes:</b><br/>");
+                build.causes.forEach(function(cause) {
+                    lines.push("- <em>" + escapeHtml(cause[0]) + ":</em><br/>");
+                    if (cause[1]) {
+                        lines.push(
+                            '<p class="failure-cause">' + escapeHtml(cause[1]) + "</p>"
+                        );
+                    }
+                });
+            }
+            if (build.sections) {
+                lines.push("<b>Sections:</b><br/>");
+                lines.push('<div class="sections">');
+                build.sections.forEach(function(section) {
+                    var text = escapeHtml(section[1]);
+                    if (section[2]) {
+                        text = '<span class="' + section[2] + '">' + text + "</span>";
+                    }
+                    var padding = new Array(section[0] * 2 + 1).join("&nbsp;");
+                    lines.push(padding + "⊩ " + text + "<br/>");
+                });
+                lines.push("</div>");
+            }
+            return lines.join("\\n");
+        }
+
+        canvas.addEventListener("mousemove", function(e) {
+            var build = findBuild(e.pageX, e.pageY);
+            canvas.style.cursor = build === null ? "default" : "pointer";
+            if (build !== hovered) {
+                hovered = build;
+                redraw();
+                if (build !== null && data.infobox) {
+                    tooltip.innerHTML = getTooltip(data.builds[build]);
+                }
+            }
+            if (build === null || !data.infobox) {
+                tooltip.style.display = "none";
+                return;
+            }
+            tooltip.style.display = "block";
+            var top = e.pageY + 5;
+            if (top + tooltip.offsetHeight > window.scrollY + window.innerHeight) {
+                top = e.pageY - 15 - tooltip.offsetHeight;
+            }
+            tooltip.style.left = (e.pageX + 5) + "px";
+            tooltip.style.top = top + "px";
+        });
+        canvas.addEventListener("mouseout", function() {
+            hovered = null;
+            tooltip.style.display = "none";
+            redraw();
+        });
+        canvas.addEventListener("click", function(e) {
+            var build = findBuild(e.pageX, e.pageY);
+            if (build !== null) {
+                window.location.href = data.builds[build].url;
+            }
+        });
+        window.addEventListener("scroll", redraw);
+        window.addEventListener("resize", redraw);
+        draw();
+    })();
+    </script>
+</body>
+</html>"""
+
+
+# Coordinates, to the tenth of a pixel
+def _number(value):
+    if isinstance(value, int):
+        return value
+    return round(float(value), 1)
+
+
+def _rgba(color, opacity):
+    red, green, blue = (round(component * 255) for component in parse_color(color))
+    return "rgba(%d,%d,%d,%s)" % (red, green, blue, opacity)
+
+
+# Colors, line width and font of each class of a style sheet like STYLES, as
+# they are drawn on a canvas
+def get_canvas_style(styles, element, class_name):
+    style = styles.get("%s.%s" % (element, class_name), styles.get(element, {}))
+
+    canvas_style = {}
+    for prefix, default in (("fill", "rgb(0,0,0)"), ("stroke", "none")):
+        color = style.get(prefix, default)
+        opacity = float(style.get("%s-opacity" % prefix, 1))
+        if color != "none" and opacity > 0:
+            canvas_style[prefix] = _rgba(color, opacity)
+
+    canvas_style["width"] = float(style.get("stroke-width", "1").rstrip("px"))
+    if element == "text":
+        size = float(style.get("font-size", "14px").rstrip("px"))
+        family = style.get("font-family", "sans-serif")
+        canvas_style["size"] = size
+        canvas_style["font"] = "%spx %s" % (_number(size), family)
+        canvas_style["align"] = "right" if style.get("text-anchor") == "end" else "left"
+    return canvas_style
+
+
+# Write a Layout as an HTML page drawing it on a canvas, instead of an image
+# of it with an area and a tooltip per build.
+#
+# The page embeds the shapes of the layout and the details of its builds as
+# JSON. It only draws the shapes in the window, found in a spatial index, and
+# builds the tooltip of a build when it is hovered. It needs no network.
+#
+# builds are the details of the builds of the layout, in the same order, as
+# given by SvgPrinter.get_build_details().
+#
+# CanvasPrinter(layout, STYLES, builds, "job #1", "SUCCESS").print_html(path)
+class CanvasPrinter:
+    def __init__(self, layout, styles, builds, title="", result="", infobox=True):
+        self.layout = layout
+        self.styles = parse_styles(styles)
+        self.builds = builds
+        self.title = title
+        self.result = result
+        self.infobox = infobox
+
+        # Index of each (element, class) in the styles of the data
+        self.__classes = {}
+        self.__canvas_styles = []
+
+    def __get_class(self, element, class_name):
+        key = (element, class_name)
+        if key not in self.__classes:
+            self.__classes[key] = len(self.__canvas_styles)
+            self.__canvas_styles.append(
+                get_canvas_style(self.styles, element, class_name)
+            )
+        return self.__classes[key]
+
+    def __get_grid(self, grid):
+        return {
+            "x": _number(grid.x),
+            "y": _number(grid.y),
+            "width": _number(grid.width),
+            "height": _number(grid.height),
+            "box": self.__get_class("rect", "box"),
+            "levels": [
+                [
+                    self.__get_class("line", level.class_name),
+                    level.interval,
+                    level.count,
+                ]
+                for level in grid.levels
+            ],
+            "labels": [
+                [
+                    _number(label.x),
+                    _number(label.y),
+                    self.__get_class("text", label.class_name),
+                    label.text,
+                ]
+                for label in grid.labels
+            ],
+        }
+
+    def __get_shape(self, shape):
+        if isinstance(shape, LayoutText):
+            return [
+                _number(shape.x),
+                _number(shape.y),
+                self.__get_class("text", shape.class_name),
+                shape.text,
+            ]
+        return [
+            _number(shape.x),
+            _number(shape.y),
+            _number(shape.width),
+            _number(shape.height),
+            self.__get_class("rect", shape.class_name),
+        ]
+
+    def get_data(self):
+        layout = self.layout
+
+        builds = []
+        for area, details in zip(layout.builds, self.builds):
+            build = dict(details)
+            build["area"] = [
+                _number(area.x),
+                _number(area.y),
+                _number(area.width),
+                _number(area.height),
+            ]
+            builds.append(build)
+
+        return {
+            "width": _number(layout.width),
+            "height": _number(layout.height),
+            "background": self.__get_class("rect", "background"),
+            "grid": self.__get_grid(layout.grid),
+            "shapes": [self.__get_shape(shape) for shape in layout.shapes],
+            "builds": builds,
+            "infobox": self.infobox,
+            "styles": self.__canvas_styles,
+        }
+
+    def print_html(self, output):
+        data = json.dumps(self.get_data(), separators=(",", ":"))
+        # Not to end the script element
+        data = data.replace("<", "\\u003c")
+
+        with open_output(output) as f_html:
+            f_html.write(CANVAS_HTML_TMPL % (self.title, self.result, data))
@@ -0,0 +1,349 @@
+import base64
+import binascii
+import logging
+import mmap
+import os
+import re
+import zlib
+import xml.etree.ElementTree as ET
+from urllib.parse import quote, unquote
+
+from .job_info import (
+    BuildInfo,
+    BuildInfoFetcher,
+    BuildNotFoundException,
+    SectionParser,
+    SectionStore,
+)
+
+logger = logging.getLogger(__name__)
+
+# Root element of build.xml -> class of the build in the JSON API
+BUILD_CLASSES = {
+    "build": "hudson.model.FreeStyleBuild",
+    "flow-build": "org.jenkinsci.plugins.workflow.job.WorkflowRun",
+    "matrix-build": "hudson.matrix.MatrixBuild",
+    "matrix-run": "hudson.matrix.MatrixRun",
+}
+
+# Lines of freestyle logs that matter to SectionParser
+SECTION_LINE_PATTERN = re.compile(rb"\[section:|Executing post build scripts")
+
+# 'build' steps of pipelines log a hyperlink to the sub-build, as a console
+# note followed by the display name of the sub-build. Lines of parallel
+# branches may be prefixed with the name of the branch.
+SUB_BUILD_PATTERN = re.compile(
+    rb"Starting building: "
+    rb"(?:\x1b\[8mha:(?P<note>[A-Za-z0-9+/=]*)\x1b\[0m)?"
+    rb"(?P<text>[^\n]*)"
+)
+BRANCH_PATTERN = re.compile(rb"\[(?P<branch>[^\]\n]*)\] ")
+NOTE_URL_PATTERN = re.compile(rb"(?P<path>(?:job/[^/\x00-\x20]+/)+)(?P<bn>\d+)/")
+DISPLAY_NAME_PATTERN = re.compile(r"^(?P<job>.+?) #(?P<bn>\d+)")
+
+
+def _text(element, path, default=None):
+    child = element.find(path)
+    if child is None or child.text is None:
+        return default
+    return child.text
+
+
+# Class name of an XStream element, '$' being written '_-'
+def _class_name(element):
+    return element.tag.replace("_-", "$")
+
+
+# Build the same content as the 'api/json' of the build from its build.xml,
+# for the fields read by BuildInfo._fetch_info().
+def parse_build_xml(data):
+    root = ET.fromstring(data)
+
+    result = _text(root, "result")
+    tree = {
+        "_class": BUILD_CLASSES.get(root.tag, root.tag),
+        "number": int(_text(root, "number", 0)),
+        "timestamp": int(_text(root, "timestamp", 0)),
+        "duration": int(_text(root, "duration", 0)),
+        "building": result is None,
+        "result": result,
+        "description": _text(root, "description"),
+        "builtOn": _text(root, "builtOn", ""),
+        "actions": [],
+    }
+
+    actions = root.find("actions")
+    for action_elmt in actions if actions is not None else []:
+        action = {"_class": _class_name(action_elmt)}
+
+        if action["_class"] == "jenkins.metrics.impl.TimeInQueueAction":
+            action["queuingDurationMillis"] = int(
+                _text(action_elmt, "queuingDurationMillis", 0)
+            )
+        elif action["_class"] == "hudson.model.CauseAction":
+            # A bag of cause -> count, or a list in older versions
+            cause_elmts = [entry[0] for entry in action_elmt.iterfind("causeBag/entry")]
+            cause_elmts += list(action_elmt.iterfind("causes/*"))
+            action["causes"] = []
+            for cause_elmt in cause_elmts:
+                cause = {"_class": _class_name(cause_elmt)}
+                for field in ["upstreamProject", "upstreamBuild", "userId", "userName"]:
+                    cause[field] = _text(cause_elmt, field)
+                if cause["upstreamBuild"] is not None:
+                    cause["upstreamBuild"] = int(cause["upstreamBuild"])
+                action["causes"].append(cause)
+        elif action["_class"] == "hudson.model.ParametersAction":
+            action["parameters"] = [
+                {
+                    "_class": _class_name(param_elmt),
+                    "name": _text(param_elmt, "name"),
+                    "value": _text(param_elmt, "value"),
+                }
+                for param_elmt in action_elmt.iterfind("parameters/*")
+            ]
+        elif action["_class"].endswith(".FailureCauseBuildAction"):
+            action["foundFailureCauses"] = [
+                {
+                    "name": _text(cause_elmt, "name"),
+                    "description": _text(cause_elmt, "description"),
+                    "categories": [
+                        category.text
+                        for category in cause_elmt.iterfind("categories/*")
+                    ],
+                }
+                for cause_elmt in action_elmt.iterfind("foundFailureCauses/*")
+            ]
+
+        tree["actions"].append(action)
+
+    return tree
+
+
+# Job name and build number of the build a hyperlink console note points to.
+# The note is base64 of a MAC, then of the gzipped serialized note.
+def get_note_build(note):
+    try:
+        data = base64.b64decode(note)
+    except (binascii.Error, ValueError):
+        return None
+
+    start = data.find(b"\x1f\x8b")
+    if start < 0:
+        return None
+
+    try:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = decompressor.decompress(data[start:])
+    except zlib.error:
+        return None
+
+    match = NOTE_URL_PATTERN.search(data)
+    if match is None:
+        return None
+
+    names = match.group("path").decode("utf-8").split("/")[1::2]
+    return ("/".join(unquote(name) for name in names), match.group("bn").decode())
+
+
+# BuildInfo reading builds from a JENKINS_HOME directory tree instead of
+# Jenkins, see JenkinsHomeFetcher.
+#
+# The console log is memory-mapped and only the lines with section markers,
+# or the links to sub-builds for pipelines, are decoded.
+class JenkinsHomeBuildInfo(BuildInfo):
+    def __init__(self, *args, **kwargs):
+        # Offset in the log up to which it has been scanned
+        self.__log_scanned = 0
+        self.__section_parser = None
+        # End of the last line fed to the section parser
+        self.__section_line_end = 0
+
+        super(JenkinsHomeBuildInfo, self).__init__(*args, **kwargs)
+
+    @property
+    def build_dir(self):
+        return self.fetcher.get_build_dir(self.job_name, self.build_number_str)
+
+    def build_url(self, extra=""):
+        if self.fetcher.url:
+            return super(JenkinsHomeBuildInfo, self).build_url(extra)
+        return "file://%s/%s" % (quote(self.build_dir), extra)
+
+    def get_build_json(self):
+        if self.build_json:
+            return self.build_json
+
+        path = os.path.join(self.build_dir, "build.xml")
+        logger.info("Reading info from '%s'", path)
+
+        try:
+            with open(path, "rb") as build_xml:
+                data = build_xml.read()
+        except OSError:
+            raise BuildNotFoundException(self)
+
+        self.build_json = parse_build_xml(data)
+        return self.build_json
+
+    # Scan the lines of the log added since the last scan, at the byte level
+    def __scan_log(self, pattern, on_match):
+        path = os.path.join(self.build_dir, "log")
+        try:
+            log_file = open(path, "rb")
+        except OSError:
+            raise BuildNotFoundException(self)
+
+        with log_file:
+            size = os.fstat(log_file.fileno()).st_size
+            if size <= self.__log_scanned:
+                return
+
+            logger.info("Scanning log '%s' from %d", path, self.__log_scanned)
+
+            with mmap.mmap(log_file.fileno(), size, access=mmap.ACCESS_READ) as log:
+                # Stop at the last complete line, the next one being written
+                end = size
+                if not self.is_done:
+                    end = log.rfind(b"\n", self.__log_scanned, size) + 1
+                    if end <= 0:
+                        return
+
+                for match in pattern.finditer(log, self.__log_scanned, end):
+                    on_match(log, match, end)
+
+                self.__log_scanned = end
+
+    def __on_section_line(self, log, match, end):
+        # Another marker of a line already fed
+        if match.start() < self.__section_line_end:
+            return
+
+        line_start = log.rfind(b"\n", 0, match.start()) + 1
+        line_end = log.find(b"\n", match.start(), end)
+        if line_end < 0:
+            line_end = end
+
+        self.__section_line_end = line_end
+        line = log[line_start:line_end].rstrip(b"\r").decode("ISO-8859-1")
+        self.__section_parser.feed_line(line)
+
+    def __on_sub_build_line(self, log, match, end):
+        sub_build = None
+        if match.group("note"):
+            sub_build = get_note_build(match.group("note"))
+
+        if sub_build is None:
+            name = DISPLAY_NAME_PATTERN.match(match.group("text").decode("utf-8"))
+            if name is None:
+                logger.warning("No sub-build in '%s'", match.group(0))
+                return
+            sub_build = (name.group("job"), name.group("bn"))
+        job_name, build_number = sub_build
+
+        branch = ""
+        line_start = log.rfind(b"\n", 0, match.start()) + 1
+        prefix = BRANCH_PATTERN.match(log, line_start, match.start())
+        if prefix is not None:
+            branch = prefix.group("branch").decode("utf-8")
+
+        logger.debug("Sub-build: %s#%s [%s]", job_name, build_number, branch)
+        try:
+            self.create_sub_build(job_name, build_number, branch)
+        except BuildNotFoundException as ex:
+            logger.error(ex)
+
+    def _fetch_sub_builds(self):
+        self._sub_builds = []
+
+        if self.virtual or self.job_type != "pipeline":
+            return
+
+        self.__scan_log(SUB_BUILD_PATTERN, self.__on_sub_build_line)
+
+        logger.info(
+            "%s#%s (%s): %d sub-build(s)",
+            self.job_name,
+            self.build_number,
+            self.job_type,
+            len(self._sub_builds),
+        )
+
+    def _determine_sections(self):
+        self._sections = SectionStore()
+
+        if self.job_type != "freestyle":
+            return
+
+        self.__section_parser = SectionParser()
+        self._sections = self.__section_parser.sections
+        self.__scan_log(SECTION_LINE_PATTERN, self.__on_section_line)
+
+    def _refresh_content(self):
+        if self.job_type == "pipeline" and self._sub_builds is not None:
+            self.__scan_log(SUB_BUILD_PATTERN, self.__on_sub_build_line)
+        elif self.__section_parser is not None:
+            self.__scan_log(SECTION_LINE_PATTERN, self.__on_section_line)
+        else:
+            self._fetch_content()
+
+    @property
+    def console_log(self):
+        if self._console_log is None:
+            path = os.path.join(self.build_dir, "log")
+            try:
+                with open(path, "rb") as log_file:
+                    self._console_log = log_file.read().decode("ISO-8859-1")
+            except OSError:
+                raise BuildNotFoundException(self)
+        return self._console_log
+
+
+# Fetcher of the builds stored in a JENKINS_HOME directory, e.g. on the
+# storage of the controller or in a backup of it: no network is involved.
+# Jobs in folders are named 'folder/job'. The URL of Jenkins, when given, is
+# only used for links to the builds.
+#
+# fetcher = JenkinsHomeFetcher("/var/lib/jenkins", url="https://jenkins/")
+class JenkinsHomeFetcher(BuildInfoFetcher):
+    def __init__(
+        self,
+        jenkins_home,
+        url=None,
+        info_class=JenkinsHomeBuildInfo,
+        fetch_sections=True,
+        workers=1,
+    ):
+        super(JenkinsHomeFetcher, self).__init__(
+            url, info_class=info_class, fetch_sections=fetch_sections, workers=workers
+        )
+        self.jenkins_home = os.path.abspath(jenkins_home)
+
+    def get_job_dir(self, job_name):
+        path = self.jenkins_home
+        for name in job_name.split("/"):
+            path = os.path.join(path, "jobs", name)
+        return path
+
+    def get_build_dir(self, job_name, build_number):
+        builds_dir = os.path.join(self.get_job_dir(job_name), "builds")
+        build_number = str(build_number)
+        if not build_number.isdigit():
+            build_number = self.__resolve_permalink(builds_dir, build_number)
+        return os.path.join(builds_dir, build_number)
+
+    # Build number of a permalink like 'lastCompletedBuild', from the
+    # 'permalinks' file of recent versions or the symlinks of older ones
+    def __resolve_permalink(self, builds_dir, permalink):
+        try:
+            with open(os.path.join(builds_dir, "permalinks")) as permalinks:
+                for line in permalinks:
+                    name, _, number = line.strip().partition(" ")
+                    if name == permalink and number != "-1":
+                        return number
+        except OSError:
+            pass
+
+        try:
+            return os.readlink(os.path.join(builds_dir, permalink))
+        except OSError:
+            return permalink
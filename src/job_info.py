@@ -1,15 +1,27 @@
-import urllib3
-import xml.etree.ElementTree as ET
+import codecs
+import contextlib
 import json
 import re
 import logging
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta, timezone
+from html.parser import HTMLParser
 from urllib.parse import urljoin
-from bs4 import BeautifulSoup
+
+from .transport import HttpTransport
 
 logger = logging.getLogger(__name__)
 
-pool_manager = urllib3.PoolManager(timeout=30.0)
+# Size of the chunks read when streaming console logs
+CHUNK_SIZE = 64 * 1024
+
+# Timestamp of the sections not started or not ended, see SectionStore
+NO_TIME = -1
+
+# Characters str.splitlines() splits on
+LINE_BREAKS = "\r\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
 
 
 def get_human_time(milliseconds):
@@ -36,6 +48,50 @@ def get_human_time(milliseconds):
     return " ".join(val)
 
 
+# Turn a list of fields into a Jenkins 'tree' query, a field being either
+# a name or a (name, [sub-fields]) tuple. Lists are merged in order.
+def get_tree_query(*field_lists):
+    merged = {}
+    for fields in field_lists:
+        for field in fields:
+            if isinstance(field, tuple):
+                name, sub_fields = field
+                merged.setdefault(name, []).append(sub_fields)
+            else:
+                merged.setdefault(field, [])
+
+    query = []
+    for name, sub_fields in merged.items():
+        if sub_fields:
+            name += "[%s]" % get_tree_query(*sub_fields)
+        query.append(name)
+    return ",".join(query)
+
+
+# Split text received chunk by chunk into lines, as str.splitlines() would
+class LineSplitter:
+    def __init__(self):
+        self.pending = ""
+
+    def feed(self, chunk):
+        lines = (self.pending + chunk).splitlines(True)
+        # The last line may continue in the next chunk
+        self.pending = lines.pop() if lines else ""
+        return [line.rstrip(LINE_BREAKS) for line in lines]
+
+    def close(self):
+        lines = self.pending.splitlines()
+        self.pending = ""
+        return lines
+
+
+def split_lines(chunks):
+    splitter = LineSplitter()
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.close()
+
+
 class BuildNotFoundException(Exception):
     def __init__(self, build_info):
 
@@ -44,14 +100,94 @@ class BuildNotFoundException(Exception):
         )
 
 
+# Sections of a build, stored as parallel arrays indexed by section:
+# - start, end: timestamps in ms, NO_TIME when unknown,
+# - depth: number of parents,
+# - type_id: index in types of the type, inherited from the parent if the
+#   section has none, -1 for no type,
+# - parent: index of the parent section, -1 for none.
+# Parents come before their children. Iterating gives BuildSection views.
+class SectionStore:
+    def __init__(self):
+        self.names = []
+        self.start = array("q")
+        self.end = array("q")
+        self.depth = array("i")
+        self.type_id = array("i")
+        self.parent = array("i")
+
+        self.types = []
+        self.__type_ids = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.names)
+        if not 0 <= index < len(self.names):
+            raise IndexError("section index out of range")
+        return BuildSection(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.names)):
+            yield BuildSection(self, index)
+
+    def add(self, name, section_type=None, parent=-1, start=None, end=None):
+        type_id = -1
+        if section_type:
+            type_id = self.__type_ids.get(section_type)
+            if type_id is None:
+                type_id = len(self.types)
+                self.__type_ids[section_type] = type_id
+                self.types.append(section_type)
+        elif parent >= 0:
+            type_id = self.type_id[parent]
+
+        depth = 0
+        if parent >= 0:
+            depth = self.depth[parent] + 1
+
+        self.names.append(name)
+        self.start.append(NO_TIME if start is None else start)
+        self.end.append(NO_TIME if end is None else end)
+        self.depth.append(depth)
+        self.type_id.append(type_id)
+        self.parent.append(parent)
+
+        return len(self.names) - 1
+
+    def get_type(self, index):
+        type_id = self.type_id[index]
+        if type_id < 0:
+            return None
+        return self.types[type_id]
+
+    def get_children(self, index):
+        return [
+            BuildSection(self, child)
+            for child in range(index + 1, len(self.names))
+            if self.parent[child] == index
+        ]
+
+
+# View of a section of a SectionStore
 class BuildSection:
-    def __init__(self, name, section_type=None):
-        self.name = name
-        self.__type = section_type
-        self.parent = None
-        self.children = []
-        self.start = None
-        self.end = None
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, BuildSection)
+            and self.store is other.store
+            and self.index == other.index
+        )
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
 
     def __str__(self):
         info = self.name
@@ -60,15 +196,46 @@ class BuildSection:
         info += " %s" % get_human_time(self.duration)
         return info
 
+    @property
+    def name(self):
+        return self.store.names[self.index]
+
     @property
     def type(self):
-        if self.__type:
-            return self.__type
+        return self.store.get_type(self.index)
 
-        if self.parent:
-            return self.parent.type
+    @property
+    def start(self):
+        start = self.store.start[self.index]
+        if start == NO_TIME:
+            return None
+        return start
 
-        return None
+    @start.setter
+    def start(self, value):
+        self.store.start[self.index] = NO_TIME if value is None else value
+
+    @property
+    def end(self):
+        end = self.store.end[self.index]
+        if end == NO_TIME:
+            return None
+        return end
+
+    @end.setter
+    def end(self, value):
+        self.store.end[self.index] = NO_TIME if value is None else value
+
+    @property
+    def parent(self):
+        parent = self.store.parent[self.index]
+        if parent < 0:
+            return None
+        return BuildSection(self.store, parent)
+
+    @property
+    def children(self):
+        return self.store.get_children(self.index)
 
     @property
     def duration(self):
@@ -81,10 +248,74 @@ class BuildSection:
 
     @property
     def parents_cnt(self):
-        cnt = 0
-        if self.parent is not None:
-            cnt = 1 + self.parent.parents_cnt
-        return cnt
+        return self.store.depth[self.index]
+
+
+# Build the sections of a freestyle build from its console log,
+# which can be fed chunk by chunk.
+class SectionParser:
+    pattern = re.compile(
+        r"^(?:.\[95m)?\[section:(?P<name>[^\]]*)\] (?P<boundary>start|end)? *"
+        "(time=(?P<time>[0-9]*))? *"
+        "(type=(?P<type>[a-z]*))? *"
+        "(.*)"
+    )
+
+    def __init__(self):
+        self.sections = SectionStore()
+        # Index of the section in progress
+        self.current = -1
+        self.splitter = LineSplitter()
+
+    def feed(self, chunk):
+        for line in self.splitter.feed(chunk):
+            self.feed_line(line)
+
+    def close(self):
+        for line in self.splitter.close():
+            self.feed_line(line)
+
+    def feed_line(self, line):
+        if "Executing post build scripts" in line:
+            # If the build was aborted while another section was in progress,
+            # stop processing the current section.
+            self.current = -1
+            return
+
+        if "[section:" not in line:
+            return
+
+        m = self.pattern.match(line)
+        if not m:
+            if "message" not in line and "echo -e" not in line:
+                logger.warning("'%s' not matched", line)
+            return
+
+        logger.debug("Section: %s", line)
+
+        boundary = m.group("boundary")
+        name = m.group("name")
+        section_type = m.group("type")
+        time = 0
+        if m.group("time"):
+            time = int(m.group("time")) * 1000
+        else:
+            logger.warning("No time in section '%s'", line)
+
+        if boundary == "start":
+            # Start
+            self.current = self.sections.add(
+                name, section_type, parent=self.current, start=time
+            )
+        elif boundary == "end":
+            # End
+            if self.current >= 0:
+                self.sections.end[self.current] = time
+                self.current = self.sections.parent[self.current]
+            else:
+                logger.warning("Noticed a end section while no section is in progress")
+        else:
+            raise Exception("Unknown boundary %s" % boundary)
 
 
 class PipelineNode:
@@ -105,7 +336,158 @@ class PipelineNode:
         return None
 
 
+# Scan the HTML console log of a pipeline build for its nodes and the builds
+# they started, calling on_sub_build(job_name, build_number, branch) for each.
+# Only the 'pipeline-new-node' and 'pipeline-node-*' spans are kept track of,
+# and the log can be fed chunk by chunk.
+class PipelineLogScanner(HTMLParser):
+    pattern = re.compile(r"/job/(?P<job>.+)/(?P<bn>\d+)/")
+
+    def __init__(self, on_sub_build):
+        super(PipelineLogScanner, self).__init__()
+        self.on_sub_build = on_sub_build
+        self.nodes = {}
+        # Open spans, None for the ones that are not pipeline nodes
+        self.spans = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                for span in self.spans:
+                    if span is not None:
+                        span["links"].append(href)
+            return
+
+        if tag != "span":
+            return
+
+        attrs = dict(attrs)
+        span_class = (attrs.get("class") or "").split()
+        span = None
+        if span_class and (
+            span_class[0] == "pipeline-new-node"
+            or span_class[0].startswith("pipeline-node-")
+        ):
+            span = {"class": span_class[0], "attrs": attrs, "text": [], "links": []}
+        self.spans.append(span)
+
+    def handle_data(self, data):
+        for span in self.spans:
+            if span is not None:
+                span["text"].append(data)
+
+    def handle_endtag(self, tag):
+        if tag != "span" or not self.spans:
+            return
+
+        span = self.spans.pop()
+        if span is not None:
+            self.__process_span(span)
+
+    def close(self):
+        super(PipelineLogScanner, self).close()
+
+        # Spans left open at the end of the log
+        spans = [span for span in self.spans if span is not None]
+        self.spans = []
+        for span in spans:
+            self.__process_span(span)
+
+    def __process_span(self, span):
+        attrs = span["attrs"]
+        text = "".join(span["text"])
+
+        if span["class"] == "pipeline-new-node":
+            node_id = attrs["nodeid"]
+
+            node = PipelineNode(node_id)
+            node.header = text
+            if "enclosingid" in attrs:
+                enclosing_id = attrs["enclosingid"]
+                if enclosing_id not in self.nodes:
+                    logger.error("Node %s does not exist", enclosing_id)
+                    return
+
+                self.nodes[enclosing_id].content[node_id] = node
+                node.parent = self.nodes[enclosing_id]
+
+            if "label" in attrs:
+                node.label = attrs["label"]
+                if node.label.startswith("Branch: "):
+                    node.branch = node.label.replace("Branch: ", "")
+
+            self.nodes[node_id] = node
+            return
+
+        node_id = span["class"].replace("pipeline-node-", "")
+        if node_id not in self.nodes:
+            logger.warning("Node %s not found", node_id)
+            return
+
+        node = self.nodes[node_id]
+
+        branch = None
+        if node.parent:
+            branch = node.get_branch()
+
+        if "Starting building:" not in text:
+            return
+
+        match = None
+        for job_href in span["links"]:
+            match = self.pattern.match(job_href)
+            if match is None:
+                continue
+
+            job_name = match.group("job")
+            build_number = match.group("bn")
+            if job_name and build_number:
+                branch_info = ""
+                if branch:
+                    branch_info = "[%s]" % branch
+                logger.debug("Sub-build: %s#%s %s", job_name, build_number, branch_info)
+
+                self.on_sub_build(job_name, build_number, branch)
+
+        if match is None:
+            logger.warning("No link found for %s", text)
+
+
 class BuildInfo:
+    # Fields of the build JSON that are parsed, see get_tree_query()
+    json_fields = [
+        "_class",
+        "number",
+        "timestamp",
+        "duration",
+        "building",
+        "result",
+        "description",
+        "builtOn",
+        (
+            "actions",
+            [
+                "_class",
+                "queuingDurationMillis",
+                (
+                    "causes",
+                    [
+                        "_class",
+                        "upstreamProject",
+                        "upstreamBuild",
+                        "userId",
+                        "userName",
+                    ],
+                ),
+                ("foundFailureCauses", ["name", "description", "categories"]),
+                ("parameters", ["_class", "name", "value"]),
+            ],
+        ),
+    ]
+    # Additional fields requested by subclasses
+    extra_json_fields = []
+
     def __init__(
         self,
         fetcher,
@@ -146,6 +528,9 @@ class BuildInfo:
         self.upstream = upstream
         self._sub_builds = None
         self.__all_builds = None
+        # Sub-builds found while the log summary is locked, fetched once it is
+        # released (see __parse_console_log)
+        self.__deferred_sub_builds = None
 
         self._fetch_sections = fetch_sections
         self._sections = None
@@ -154,11 +539,22 @@ class BuildInfo:
 
         self.build_json = None
         self._raw_data = None
+        # Content fetched ahead of time by the fetcher, by URL extra
+        self._preloaded = {}
+        # See _get_validators()
+        self._validators = {}
 
         self._description = None
         self._failure_causes = None
         self._console_log = None
 
+        # Progress in the console log of a build in progress, so that a
+        # refresh only fetches and parses the new part of it.
+        self._log_offset = None
+        self._log_more_data = False
+        self._log_annotator = None
+        self._log_parser = None
+
         self.cache = cache
 
         self.lane_index = None
@@ -168,7 +564,10 @@ class BuildInfo:
 
     def fetch(self, fatal=False):
         self._fetch_info(fatal)
+        self._fetch_content()
 
+    # Fetch what depends on the console log: sub-builds and sections
+    def _fetch_content(self):
         if self._sub_builds is None:
             self._fetch_sub_builds()
 
@@ -176,7 +575,7 @@ class BuildInfo:
             # Only fetch sections if the top build is done
             self._fetch_sections = self.is_done
         if self._sections is None and self._fetch_sections is True:
-            self.__determine_sections()
+            self._determine_sections()
 
     def build_url(self, extra=""):
         if self._build_url:
@@ -189,48 +588,329 @@ class BuildInfo:
     def set_build_url(self, value):
         self._build_url = value
 
-    def __fetch_build_data(self, extra="", encoding="ISO-8859-1"):
+    def _cache_key(self, extra="", kind=None):
+        if self.cache and self._build_number:
+            url = self.build_url(extra)
+            # The build of a permalink changes, its contents are cached by number
+            if not self._build_url and not self.build_number_str.isdigit():
+                url = urljoin(
+                    self.fetcher.url,
+                    "/".join(["job", self.job_name, str(self._build_number), extra]),
+                )
+            if kind:
+                return "jenkins-build-analyzer-%s-%s" % (kind, url)
+            return "jenkins-build-analyzer-%s" % url
+        return None
+
+    # Contents not found are remembered for the run, and for a while in the
+    # cache, so that deleted builds are not requested again and again.
+    def _is_not_found(self, extra):
+        api_url = self.build_url(extra)
+        if api_url in self.fetcher.not_found:
+            return True
+
+        cache_key = self._cache_key(extra, "not-found")
+        if cache_key and self.cache.get(cache_key):
+            self.fetcher.not_found.add(api_url)
+            return True
+
+        return False
+
+    def _set_not_found(self, extra):
+        self.fetcher.not_found.add(self.build_url(extra))
+
+        cache_key = self._cache_key(extra, "not-found")
+        if cache_key:
+            try:
+                self.cache.set(cache_key, "404", self.fetcher.not_found_ttl)
+            except Exception:
+                logger.exception("Unable to set cache for '%s'", cache_key)
+
+    # ETag / Last-Modified of the contents of builds in progress, with the
+    # content, so that fetching them again only costs a 304 when they have not
+    # changed. The contents of completed builds are cached as they are instead.
+    def _get_validators(self, extra):
+        validators = self._validators.get(extra)
+        if validators is None:
+            cache_key = self._cache_key(extra, "validators")
+            if cache_key:
+                raw_data = self.cache.get(cache_key)
+                if raw_data:
+                    validators = json.loads(raw_data)
+        return validators
+
+    def _set_validators(self, extra, headers, raw_data):
+        if "ETag" not in headers and "Last-Modified" not in headers:
+            return
+        # Progressive logs depend on the offset and on their headers
+        if "X-Text-Size" in headers:
+            return
+
+        validators = {
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "data": raw_data,
+        }
+        if self.build_json is None:
+            # The JSON of the build itself, saved once it is known whether the
+            # build is done (see get_build_json)
+            self._validators[extra] = validators
+            return
+        if self.is_done:
+            self._validators.pop(extra, None)
+            return
+
+        self._validators[extra] = validators
+        self.__save_validators(extra)
+
+    def __save_validators(self, extra):
+        validators = self._validators.get(extra)
+        cache_key = self._cache_key(extra, "validators")
+        if validators and cache_key:
+            try:
+                self.cache.set(
+                    cache_key, json.dumps(validators), self.fetcher.revalidation_ttl
+                )
+            except Exception:
+                logger.exception("Unable to set cache for '%s'", cache_key)
+
+    # Headers of a conditional GET
+    def _get_conditional_headers(self, validators):
+        headers = {}
+        if validators:
+            if validators["etag"]:
+                headers["If-None-Match"] = validators["etag"]
+            if validators["last_modified"]:
+                headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    # Contents that _fetch_content() would fetch, but the console log, and
+    # that are not available yet: a fetcher may download them beforehand
+    # (see AsyncBuildInfoFetcher), until there are none left
+    def _get_missing_contents(self):
+        return []
+
+    # Whether the console log has to be parsed, for sub-builds or sections
+    def _needs_log_parsing(self):
+        if self.virtual:
+            return False
+
+        if self.job_type == "pipeline":
+            return self._sub_builds is None
+
+        fetch_sections = self._fetch_sections
+        if fetch_sections == "done":
+            fetch_sections = self.is_done
+        return (
+            self._sections is None
+            and fetch_sections is True
+            and self.job_type == "freestyle"
+        )
+
+    # Parser of the console log: sub-builds of pipelines, sections of
+    # freestyle builds. It is kept to parse what a refresh brings.
+    def _get_log_parser(self):
+        if self._log_parser is None:
+            if self.job_type == "pipeline":
+                self._sub_builds = []
+                self._log_parser = PipelineLogScanner(self.__on_sub_build)
+            else:
+                self._log_parser = SectionParser()
+                self._sections = self._log_parser.sections
+        return self._log_parser
+
+    # Called once the available console log has been fed to the parser
+    def _end_log_parsing(self):
+        # Otherwise the end of the log may be completed by the next refresh
+        if not self._log_more_data:
+            self._log_parser.close()
+
+    def __parse_log(self, chunks):
+        parser = self._get_log_parser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        self._end_log_parsing()
+
+    def _fetch_build_data(self, extra="", encoding="ISO-8859-1", check_cache=True):
         raw_data = None
-        cache_key = None
         api_url = self.build_url(extra)
-        if self.cache and self._build_number:
-            cache_key = "jenkins-build-analyzer-%s" % api_url
+        cache_key = self._cache_key(extra)
+        if cache_key and check_cache:
             raw_data = self.cache.get(cache_key)
 
         if raw_data:
             logger.info("Content for '%s' already cached", api_url)
             return (raw_data, True, cache_key)
 
+        if extra in self._preloaded:
+            raw_data = self._preloaded.pop(extra)
+            if isinstance(raw_data, BuildNotFoundException):
+                raise raw_data
+            return (raw_data, False, cache_key)
+
+        if self._is_not_found(extra):
+            raise BuildNotFoundException(self)
+
         logger.info("Fetching info from '%s'", api_url)
 
-        content = pool_manager.urlopen("GET", api_url)
+        validators = self._get_validators(extra)
+        headers = self._get_conditional_headers(validators)
+
+        content = self.fetcher.transport.request(api_url, headers=headers)
+        if content.status == 304 and validators:
+            logger.info("Content for '%s' not modified", api_url)
+            return (validators["data"], False, cache_key)
+        if content.status == 404:
+            self._set_not_found(extra)
         if content.status != 200:
             raise BuildNotFoundException(self)
 
+        self._read_log_headers(content.headers)
         raw_data = content.data.decode(encoding)
+        self._set_validators(extra, content.headers, raw_data)
 
         return (raw_data, False, cache_key)
 
+    # Same as _fetch_build_data() but yield the content chunk by chunk,
+    # without keeping it around.
+    def __stream_build_data(self, extra="", encoding="ISO-8859-1"):
+        api_url = self.build_url(extra)
+        cache_key = self._cache_key(extra)
+        if cache_key:
+            raw_data = self.cache.get(cache_key)
+            if raw_data:
+                logger.info("Content for '%s' already cached", api_url)
+                yield raw_data
+                return
+
+        if extra in self._preloaded:
+            raw_data = self._preloaded.pop(extra)
+            if isinstance(raw_data, BuildNotFoundException):
+                raise raw_data
+            yield raw_data
+            return
+
+        if self._is_not_found(extra):
+            raise BuildNotFoundException(self)
+
+        logger.info("Streaming info from '%s'", api_url)
+
+        content = self.fetcher.transport.request(api_url, preload_content=False)
+        try:
+            if content.status == 404:
+                self._set_not_found(extra)
+            if content.status != 200:
+                raise BuildNotFoundException(self)
+
+            self._read_log_headers(content.headers)
+            decoder = codecs.getincrementaldecoder(encoding)()
+            for chunk in content.stream(CHUNK_SIZE):
+                yield decoder.decode(chunk)
+            yield decoder.decode(b"", final=True)
+        finally:
+            content.release_conn()
+
+    # Remember how much of the log has been consumed, from the headers
+    # of the progressive log endpoints.
+    def _read_log_headers(self, headers):
+        if "X-Text-Size" not in headers:
+            return
+        self._log_offset = int(headers["X-Text-Size"])
+        self._log_more_data = headers.get("X-More-Data") == "true"
+        self._log_annotator = headers.get("X-ConsoleAnnotator")
+
+    # Fetch the part of the console log written since the last fetch
+    def __fetch_log_update(self, encoding="ISO-8859-1"):
+        extra = "%s?start=%d" % (self.progressive_log_url_extra, self._log_offset)
+        api_url = self.build_url(extra)
+
+        headers = {}
+        if self._log_annotator:
+            headers["X-ConsoleAnnotator"] = self._log_annotator
+
+        logger.info("Fetching log update from '%s'", api_url)
+
+        content = self.fetcher.transport.request(api_url, headers=headers)
+        if content.status != 200:
+            raise BuildNotFoundException(self)
+
+        self._read_log_headers(content.headers)
+        return content.data.decode(encoding)
+
+    # Let a single process fetch a content at once, if the cache supports it
+    def _cache_lock(self, extra):
+        cache_key = self._cache_key(extra)
+        if cache_key is None or not hasattr(self.cache, "lock"):
+            return contextlib.nullcontext()
+        return self.cache.lock(cache_key)
+
+    # Get a content from the cache, decoded. A cache that keeps the decoded
+    # objects (see MemoryCache) saves decoding it again. An entry that cannot
+    # be decoded, e.g. truncated, is dropped so that the content is fetched
+    # again.
+    def _get_cached(self, cache_key, decode=json.loads):
+        if cache_key is None:
+            return None
+
+        try:
+            if hasattr(self.cache, "get_decoded"):
+                return self.cache.get_decoded(cache_key, decode)
+
+            raw_data = self.cache.get(cache_key)
+            if not raw_data:
+                return None
+            return decode(raw_data)
+        except ValueError as ex:
+            logger.warning("Invalid content in cache for '%s': %s", cache_key, ex)
+            if hasattr(self.cache, "delete"):
+                self.cache.delete(cache_key)
+            return None
+
+    def _set_cached(self, cache_key, raw_data, value):
+        try:
+            if hasattr(self.cache, "set_decoded"):
+                self.cache.set_decoded(
+                    cache_key, raw_data, value, self.fetcher.cache_ttl
+                )
+            else:
+                self.cache.set(cache_key, raw_data, self.fetcher.cache_ttl)
+        except Exception:
+            logger.exception("Unable to set cache for '%s'", cache_key)
+
     def get_build_json(self):
         if self.build_json:
             return self.build_json
 
-        self._raw_data, content_cached, cache_key = self.__fetch_build_data(
-            "api/json?depth=3"
-        )
-        try:
-            self.build_json = json.loads(self._raw_data)
-        except json.decoder.JSONDecodeError as ex:
-            logger.error("Unable to parse JSON at '%s'", self.build_url())
-            logger.error(ex)
-            raise BuildNotFoundException(self)
+        extra = self.json_url_extra
+        with self._cache_lock(extra):
+            cache_key = self._cache_key(extra)
+            self.build_json = self._get_cached(cache_key)
+            if self.build_json:
+                logger.info("Content for '%s' already cached", self.build_url(extra))
+                return self.build_json
 
-        if self.cache and cache_key and not content_cached and self.is_done:
+            self._raw_data, _, cache_key = self._fetch_build_data(
+                extra, check_cache=False
+            )
             try:
-                # Cache the content for 5h
-                self.cache.set(cache_key, self._raw_data, (5 * 60 * 60))
-            except Exception:
-                logger.exception("Unable to set cache for build xml")
+                self.build_json = json.loads(self._raw_data)
+            except json.decoder.JSONDecodeError as ex:
+                logger.error("Unable to parse JSON at '%s'", self.build_url())
+                logger.error(ex)
+                raise BuildNotFoundException(self)
+
+            # Not self.is_done, the result depends on failure causes not parsed yet
+            is_done = (
+                not self.build_json.get("building")
+                and self.build_json.get("result") is not None
+            )
+            if cache_key and is_done:
+                self._set_cached(cache_key, self._raw_data, self.build_json)
+
+            if is_done:
+                self._validators.pop(extra, None)
+            else:
+                self.__save_validators(extra)
 
         return self.build_json
 
@@ -285,10 +965,9 @@ class BuildInfo:
                         upstream_job = cause_elmt["upstreamProject"]
                         upstream_build = cause_elmt["upstreamBuild"]
                         if upstream_job and upstream_build:
-                            self.upstream = self.fetcher.get_build(
+                            self.upstream = self.fetcher.lookup_build(
                                 upstream_job,
                                 upstream_build,
-                                fetch=False,
                                 fetch_sections=False,
                             )
                     elif cause_class == "hudson.model.Cause$UserIdCause":
@@ -507,44 +1186,61 @@ class BuildInfo:
 
         return self._failure_causes
 
+    @property
+    def json_url_extra(self):
+        return "api/json?tree=%s" % get_tree_query(
+            self.json_fields, self.extra_json_fields
+        )
+
+    @property
+    def progressive_log_url_extra(self):
+        if self.job_type == "pipeline":
+            return "logText/progressiveHtml"
+        return "logText/progressiveText"
+
+    @property
+    def console_log_url_extra(self):
+        # The progressive log gives the offset to resume from on refresh
+        if self.job_type == "pipeline" or self.result == "IN_PROGRESS":
+            return self.progressive_log_url_extra
+        return "consoleText"
+
     @property
     def console_log(self):
         if self._console_log:
             return self._console_log
 
-        url_extra = "consoleText"
-        if self.job_type == "pipeline":
-            url_extra = "logText/progressiveHtml"
-
-        raw_data, content_cached, cache_key = self.__fetch_build_data(url_extra)
+        with self._cache_lock(self.console_log_url_extra):
+            raw_data, content_cached, cache_key = self._fetch_build_data(
+                self.console_log_url_extra
+            )
 
-        self._console_log = raw_data
+            self._console_log = raw_data
 
-        if (
-            self.cache
-            and cache_key
-            and not content_cached
-            and self._result != "IN_PROGRESS"
-        ):
-            try:
-                # Cache the content for 5h
-                self.cache.set(cache_key, self._console_log, (5 * 60 * 60))
-            except Exception:
-                logger.exception(
-                    "Unable to set cache for console log (size=%s)",
-                    len(self._console_log),
-                )
+            if (
+                self.cache
+                and cache_key
+                and not content_cached
+                and self._result != "IN_PROGRESS"
+            ):
+                try:
+                    self.cache.set(cache_key, self._console_log, self.fetcher.cache_ttl)
+                except Exception:
+                    logger.exception(
+                        "Unable to set cache for console log (size=%s)",
+                        len(self._console_log),
+                    )
 
         return self._console_log
 
     def create_sub_build(self, job_name, build_number, stage=""):
-        sub_build = self.fetcher.get_build(job_name, build_number, fetch=False)
+        sub_build = self.fetcher.lookup_build(job_name, build_number)
         sub_build.stage = stage
         sub_build.upstream = self
-        try:
-            sub_build.fetch()
-        except BuildNotFoundException as ex:
-            logger.warning(ex)
+        if self.__deferred_sub_builds is not None:
+            self.__deferred_sub_builds.append(sub_build)
+        else:
+            self.fetcher.fetch_sub_build(sub_build)
 
         # Append
         if not self._sub_builds:
@@ -553,96 +1249,13 @@ class BuildInfo:
 
         return sub_build
 
-    def __parse_pipeline_log(self):
-
+    def __on_sub_build(self, job_name, build_number, branch):
         try:
-            doc = BeautifulSoup(
-                "<html>{0}</html>".format(self.console_log), features="html.parser"
-            )
-        except ET.ParseError as e:
-            logger.error("Unable to parse HTML from '%s'", self.build_url())
-            logger.error(e)
-            return
-
-        pattern = re.compile(r"/job/(?P<job>.+)/(?P<bn>\d+)/")
-
-        nodes = {}
-
-        for span in doc.find_all("span"):
-            if "class" not in span.attrs:
-                continue
-
-            span_class = span.attrs["class"][0]
-
-            if span_class == "pipeline-new-node":
-                node_id = span.attrs["nodeid"]
-
-                # start_id = span.attrs['startid']
-
-                node = PipelineNode(node_id)
-                node.header = span.text
-                if "enclosingid" in span.attrs:
-                    enclosing_id = span.attrs["enclosingid"]
-                    if not nodes[enclosing_id]:
-                        logger.error("Node %s does not exist", enclosing_id)
-                        continue
-
-                    nodes[enclosing_id].content[node_id] = node
-                    node.parent = nodes[enclosing_id]
+            self.create_sub_build(job_name, build_number, branch)
 
-                if "label" in span.attrs:
-                    node.label = span.attrs["label"]
-                    if node.label.startswith("Branch: "):
-                        node.branch = span.attrs["label"].replace("Branch: ", "")
-
-                nodes[node_id] = node
-
-            elif span_class.startswith("pipeline-node-"):
-                node_id = span_class.replace("pipeline-node-", "")
-                if node_id not in nodes:
-                    logger.warning("Node %s not found", node_id)
-                    continue
-
-                node = nodes[node_id]
-
-                branch = None
-                if node.parent:
-                    branch = node.get_branch()
-
-                if "Starting building:" not in span.text:
-                    continue
-
-                match = None
-                for job_link in span.find_all("a"):
-
-                    job_href = job_link.attrs["href"]
-
-                    match = pattern.match(job_href)
-                    if match is None:
-                        continue
-
-                    job_name = match.group("job")
-                    build_number = match.group("bn")
-                    if job_name and build_number:
-                        branch_info = ""
-                        if branch:
-                            branch_info = "[%s]" % branch
-                        logger.debug(
-                            "Sub-build: %s#%s %s", job_name, build_number, branch_info
-                        )
-
-                        try:
-                            self.create_sub_build(job_name, build_number, branch)
-
-                        except BuildNotFoundException as ex:
-                            logger.error(ex)
-                            logger.warning(branch)
-
-                if match is None:
-                    logger.warning("No link found for %s", span.text)
-
-            else:
-                logger.debug(span)
+        except BuildNotFoundException as ex:
+            logger.error(ex)
+            logger.warning(branch)
 
     # Retrieve the 'sub-builds', which are launched from this job.
     def _fetch_sub_builds(self):
@@ -656,7 +1269,7 @@ class BuildInfo:
 
         # Parse log as HTML
         if self.job_type == "pipeline":
-            self.__parse_pipeline_log()
+            self.__parse_console_log()
 
         logger.info(
             "%s#%s (%s): %d sub-build(s)",
@@ -666,77 +1279,132 @@ class BuildInfo:
             len(self._sub_builds),
         )
 
-    def __determine_sections(self):
-        self._sections = []
+    # What is parsed from the console log of a completed build is cached
+    # instead of the log itself: the sub-builds of pipelines and the sections
+    # of freestyle builds.
+    def _load_log_summary(self):
+        cache_key = self._cache_key("log-summary")
+        if cache_key is None:
+            return False
 
-        if self.job_type != "freestyle":
+        summary = self._get_cached(cache_key)
+        if not summary:
+            return False
+
+        logger.info("Log summary for '%s' already cached", self.build_url())
+
+        if "sub_builds" in summary:
+            self._sub_builds = []
+            for job_name, build_number, stage in summary["sub_builds"]:
+                self.__on_sub_build(job_name, build_number, stage)
+
+        if "sections" in summary:
+            self._sections = SectionStore()
+            for name, section_type, start, end, parent in summary["sections"]:
+                if parent is None:
+                    parent = -1
+                self._sections.add(name, section_type, parent, start, end)
+
+        return True
+
+    def _save_log_summary(self):
+        cache_key = self._cache_key("log-summary")
+        if cache_key is None or self._log_more_data or not self.is_done:
             return
 
-        pattern = re.compile(
-            r"^(?:.\[95m)?\[section:(?P<name>[^\]]*)\] (?P<boundary>start|end)? *"
-            "(time=(?P<time>[0-9]*))? *"
-            "(type=(?P<type>[a-z]*))? *"
-            "(.*)"
-        )
-        pattern_reset = re.compile(".*Executing post build scripts.*")
-        current = None
-
-        for line in self.console_log.splitlines():
-            if pattern_reset.match(line):
-                # If the build was aborted while another section was in progress,
-                # stop processing the current section.
-                current = None
-                continue
+        summary = {}
+        if self.job_type == "pipeline":
+            summary["sub_builds"] = [
+                (build.job_name, build.build_number_str, build.stage)
+                for build in self._sub_builds
+            ]
+        else:
+            summary["sections"] = [
+                (
+                    section.name,
+                    section.type,
+                    section.start,
+                    section.end,
+                    section.parent.index if section.parent else None,
+                )
+                for section in self._sections
+            ]
 
-            m = pattern.match(line)
-            if not m:
-                if (
-                    "[section:" in line
-                    and "message" not in line
-                    and "echo -e" not in line
-                ):
-                    logger.warning("'%s' not matched", line)
-                continue
+        self._set_cached(cache_key, json.dumps(summary), summary)
 
-            logger.debug("Section: %s", line)
+    def __parse_console_log(self):
+        # Sequential fetches would fetch the whole tree of sub-builds with the
+        # lock held, nested builds waiting for it
+        if self.fetcher.workers <= 1:
+            self.__deferred_sub_builds = []
 
-            boundary = m.group("boundary")
-            name = m.group("name")
-            section_type = m.group("type")
-            time = 0
-            if m.group("time"):
-                time = int(m.group("time")) * 1000
-            else:
-                logger.warning("No time in section '%s'", line)
-
-            if boundary == "start":
-                # Start
-                new = BuildSection(name, section_type)
-                self._sections.append(new)
-
-                if current:
-                    new.parent = current
-                    current.children.append(new)
-
-                current = new
-                current.start = time
-            elif boundary == "end":
-                # End
-                if current:
-                    current.end = time
-                    current = current.parent
-                else:
-                    logger.warning(
-                        "Noticed a end section while no section is in progress"
-                    )
-            else:
-                raise Exception("Unknown boundary %s" % boundary)
+        try:
+            with self._cache_lock("log-summary"):
+                if not self._load_log_summary():
+                    self.__parse_log(self.console_log_chunks())
+                    self._save_log_summary()
+        finally:
+            sub_builds = self.__deferred_sub_builds or []
+            self.__deferred_sub_builds = None
+
+        for sub_build in sub_builds:
+            self.fetcher.fetch_sub_build(sub_build)
+
+    # Iterate over the console log. Unless it has already been retrieved,
+    # the log is streamed so that only a chunk is in memory at once.
+    def console_log_chunks(self):
+        if self._console_log:
+            return [self._console_log]
+        return self.__stream_build_data(self.console_log_url_extra)
+
+    def _determine_sections(self):
+        self._sections = SectionStore()
+
+        if self.job_type != "freestyle":
+            return
+
+        self.__parse_console_log()
 
         for section in self._sections:
             logger.debug(
                 "Section: %s %s %s", section.name, section.type, section.duration
             )
 
+    # Update a build in progress: its info is fetched again, but only the
+    # new part of its console log is fetched and parsed.
+    def refresh(self):
+        if self.virtual or self.is_done:
+            return
+
+        logger.debug("Refreshing %s", self)
+
+        self._info_fetched = False
+        self.build_json = None
+        self._result = None
+        self._fetch_info()
+
+        sub_builds = list(self._sub_builds or [])
+
+        self._refresh_content()
+
+        # New sub-builds have just been fetched, refresh the others
+        for sub_build in sub_builds:
+            sub_build.refresh()
+
+        self.__all_builds = None
+
+    # Fetch and parse what has been added to the console log
+    def _refresh_content(self):
+        if self._log_offset is None:
+            self._fetch_content()
+            return
+
+        log = self.__fetch_log_update()
+        if self._console_log:
+            self._console_log += log
+        if self._log_parser is not None:
+            self.__parse_log([log])
+
     @property
     def sub_builds(self):
         if self._sub_builds is None:
@@ -765,13 +1433,44 @@ class BuildInfo:
 
 
 class BuildInfoFetcher:
-    def __init__(self, url, cache=None, info_class=BuildInfo, fetch_sections=True):
+    def __init__(
+        self,
+        url,
+        cache=None,
+        info_class=BuildInfo,
+        fetch_sections=True,
+        workers=1,
+        cache_ttl=5 * 60 * 60,
+        transport=None,
+    ):
         self.url = url
         self.cache = cache
+        # TTL of the content of completed builds in the cache, None for no expiry
+        self.cache_ttl = cache_ttl
+        # TTL in the cache of the ETag/Last-Modified of contents, and of the
+        # contents that were not found
+        self.revalidation_ttl = 60 * 60
+        self.not_found_ttl = 10 * 60
+        # URLs not found during this run
+        self.not_found = set()
         self.info_class = info_class
         self.fetch_sections = fetch_sections
         self.builds = {}
 
+        # Number of builds fetched in parallel, 1 meaning the whole tree
+        # is fetched sequentially (depth-first) in the calling thread.
+        self.workers = workers
+        self._lock = threading.RLock()
+        self._executor = None
+        self._pending = []
+        self._scheduled = set()
+
+        # Workers and the calling thread hold a connection each, and
+        # sequential fetches nest the log streams of the upstream builds.
+        if transport is None:
+            transport = HttpTransport(maxsize=max(workers + 1, 10))
+        self.transport = transport
+
     def _create_build(self, job_name, build_number, fetch_sections=None):
         if fetch_sections is None:
             fetch_sections = self.fetch_sections
@@ -784,17 +1483,113 @@ class BuildInfoFetcher:
             fetch_sections=fetch_sections,
         )
 
+    # Return the build registered in this fetcher, without fetching it
+    def lookup_build(self, job_name, build_number, fetch_sections=None):
+        build_id = "%s #%s" % (job_name, build_number)
+        with self._lock:
+            if build_id not in self.builds:
+                self.builds[build_id] = self._create_build(job_name, build_number)
+            return self.builds[build_id]
+
     def get_build(
         self, job_name, build_number, fetch=True, fetch_sections=None, fatal=False
     ):
+        if not fetch:
+            return self.lookup_build(job_name, build_number, fetch_sections)
+
         build_id = "%s #%s" % (job_name, build_number)
-        if build_id not in self.builds:
+        with self._lock:
+            build = self.builds.get(build_id)
+            if build is not None:
+                return build
             build = self._create_build(job_name, build_number)
-            if fetch:
-                build.fetch(fatal=fatal)
-            self.builds[build_id] = build
 
-        return self.builds[build_id]
+        if self.workers > 1:
+            self.fetch_tree(build, fatal=fatal)
+        else:
+            build.fetch(fatal=fatal)
+
+        with self._lock:
+            self.builds[build_id] = build
+        return build
 
     def fetch(self, job_name, build_number, fatal=False):
         return self.get_build(job_name, build_number, fatal=fatal)
+
+    def __fetch_sub_build(self, build):
+        try:
+            build.fetch()
+        except BuildNotFoundException as ex:
+            logger.warning(ex)
+
+    def fetch_sub_build(self, build):
+        if self.workers <= 1:
+            self.__fetch_sub_build(build)
+            return
+
+        with self._lock:
+            if build in self._scheduled:
+                return
+            self._scheduled.add(build)
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="fetcher"
+                )
+            # The executor queue is FIFO, so the tree is walked breadth-first
+            self._pending.append(self._executor.submit(self.__fetch_sub_build, build))
+
+    # Fetch a build and all its sub-builds, the sub-builds being fetched
+    # concurrently by the worker threads as they get discovered.
+    # The order of the sub-builds only depends on the logs of their
+    # upstream builds, so 'all_builds' is the same as with a sequential fetch.
+    def fetch_tree(self, build, fatal=False):
+        with self._lock:
+            self._scheduled.add(build)
+
+        build.fetch(fatal=fatal)
+        self.__wait_pending()
+
+    # Refresh a build in progress and its sub-builds, see BuildInfo.refresh()
+    def refresh_tree(self, build):
+        build.refresh()
+        self.__wait_pending()
+
+    # Drop a build, its sub-builds and their upstream builds from this
+    # fetcher, when walking many builds that are not needed once processed
+    def forget_tree(self, build):
+        with self._lock:
+            for bld in build.all_builds:
+                for forgotten in [bld, bld.upstream]:
+                    if forgotten is None:
+                        continue
+                    build_id = "%s #%s" % (
+                        forgotten.job_name,
+                        forgotten.build_number_str,
+                    )
+                    if self.builds.get(build_id) is forgotten:
+                        del self.builds[build_id]
+                    self._scheduled.discard(forgotten)
+
+    # Stop the worker threads, once the builds of this fetcher are fetched
+    def close(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown()
+
+    def __wait_pending(self):
+        errors = []
+        while True:
+            with self._lock:
+                futures = self._pending
+                self._pending = []
+            if not futures:
+                break
+            wait(futures)
+            errors += [f.exception() for f in futures if f.exception() is not None]
+
+        # Propagate unexpected errors from the workers once the queue is drained
+        if errors:
+            raise errors[0]
@@ -0,0 +1,126 @@
+import heapq
+import math
+
+
+# Lanes of the 'compact' index mode: interval scheduling of the boxes of the
+# builds, which are allocated by increasing x.
+#
+# Lanes are kept in a min-heap by the x they are free at, and moved to a heap
+# of free lanes by index as x goes on, so that a box takes the first free lane
+# and the number of lanes is minimal: O(n log n) for n boxes.
+#
+# The box of a lane is only complete once the next box is allocated, its
+# max_x is read then.
+class CompactLanes:
+    def __init__(self):
+        self.count = 0
+        # Last box of each lane, and its sequence number
+        self.__boxes = {}
+        self.__seq = 0
+        self.__pending = []
+
+        self.__busy = []
+        self.__free = []
+
+    def add(self, lane, box):
+        self.__seq += 1
+        self.__boxes[lane] = (box, self.__seq)
+        self.__pending.append(lane)
+        self.count = max(self.count, lane + 1)
+
+    def __flush(self):
+        for lane in self.__pending:
+            box, seq = self.__boxes[lane]
+            heapq.heappush(self.__busy, (box.max_x, lane, seq))
+        self.__pending = []
+
+    # Entries of lanes which got another box since are skipped
+    def __is_current(self, lane, seq):
+        return self.__boxes[lane][1] == seq
+
+    def allocate(self, x):
+        self.__flush()
+
+        while self.__busy and self.__busy[0][0] < x:
+            free_at, lane, seq = heapq.heappop(self.__busy)
+            if self.__is_current(lane, seq):
+                heapq.heappush(self.__free, (lane, seq))
+
+        while self.__free:
+            lane, seq = heapq.heappop(self.__free)
+            if self.__is_current(lane, seq):
+                return lane
+
+        return self.count
+
+
+# Lanes of the 'upstream' index mode: boxes are allocated by increasing x as
+# well, each taking the first lane free at its x below the lane of its
+# upstream build, so that sub-builds stay next to their parent, else the first
+# free lane. The number of lanes is still minimal.
+#
+# A segment tree of the x each lane is free at finds that lane in O(log n).
+class UpstreamLanes:
+    def __init__(self):
+        self.count = 0
+        self.__size = 1
+        self.__tree = [-math.inf] * 2
+        self.__pending = []
+
+    def add(self, lane, box):
+        self.__pending.append((lane, box))
+        self.count = max(self.count, lane + 1)
+
+    def __flush(self):
+        for lane, box in self.__pending:
+            self.__update(lane, box.max_x)
+        self.__pending = []
+
+    def __grow(self, size):
+        first_leaf = self.__size
+        leaves = self.__tree[first_leaf:]
+        while self.__size < size:
+            self.__size *= 2
+        leaves += [-math.inf] * (self.__size - len(leaves))
+
+        self.__tree = [-math.inf] * self.__size + leaves
+        for node in range(self.__size - 1, 0, -1):
+            self.__tree[node] = min(self.__tree[2 * node], self.__tree[2 * node + 1])
+
+    def __update(self, lane, free_at):
+        if lane >= self.__size:
+            self.__grow(lane + 1)
+
+        node = self.__size + lane
+        # Lanes given by the builds may get boxes that are not the last ones
+        self.__tree[node] = max(self.__tree[node], free_at)
+        node //= 2
+        while node:
+            self.__tree[node] = min(self.__tree[2 * node], self.__tree[2 * node + 1])
+            node //= 2
+
+    # First used lane from first_lane which is free at x, in the subtree of
+    # node
+    def __find(self, node, node_first, node_last, first_lane, x):
+        if node_last < first_lane or node_first >= self.count:
+            return None
+        if self.__tree[node] >= x:
+            return None
+        if node_first == node_last:
+            return node_first
+
+        middle = (node_first + node_last) // 2
+        lane = self.__find(2 * node, node_first, middle, first_lane, x)
+        if lane is None:
+            lane = self.__find(2 * node + 1, middle + 1, node_last, first_lane, x)
+        return lane
+
+    def allocate(self, x, first_lane=0):
+        self.__flush()
+
+        lane = self.__find(1, 0, self.__size - 1, first_lane, x)
+        if lane is None and first_lane > 0:
+            lane = self.__find(1, 0, self.__size - 1, 0, x)
+        if lane is None:
+            lane = self.count
+        return lane
@@ -0,0 +1,546 @@
+import logging
+
+import numpy
+
+from .job_info import NO_TIME, get_human_time
+from .lanes import CompactLanes, UpstreamLanes
+
+logger = logging.getLogger(__name__)
+
+SECOND = 1000
+MINUTE = 60 * SECOND
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# Intervals between the lines of the grid, between its labels, and of the
+# stressed lines, in ms
+TICK_INTERVALS = (
+    [n * SECOND for n in [1, 2, 5, 10, 15, 30]]
+    + [n * MINUTE for n in [1, 2, 5, 10, 15, 30]]
+    + [n * HOUR for n in [1, 2, 3, 6, 12]]
+    + [n * DAY for n in [1, 2, 7]]
+)
+STRESS_INTERVALS = [MINUTE, HOUR, DAY, 7 * DAY]
+
+# Minimum space between the lines of the grid, and between its labels, in px
+MIN_TICK_WIDTH = 10
+MIN_LABEL_WIDTH = 50
+
+
+class BoundaryBox:
+    def __init__(self, obj, x=None, y=None, max_x=None, max_y=None):
+        self.obj = obj
+        self.x = x
+        self.y = y
+        self.max_x = max_x
+        self.max_y = max_y
+
+    def __str__(self):
+        return "Box %s: (x=%s, y=%s) -> (x=%s, y=%s)" % (
+            self.obj,
+            self.x,
+            self.y,
+            self.max_x,
+            self.max_y,
+        )
+
+    def add_rect(self, insert, size):
+        max_x = insert[0] + size[0]
+        max_y = insert[1] + size[1]
+        if self.x is None or insert[0] < self.x:
+            self.x = insert[0]
+        if self.y is None or insert[1] < self.y:
+            self.y = insert[1]
+        if self.max_x is None or self.max_x < max_x:
+            self.max_x = max_x
+        if self.max_y is None or self.max_y < max_y:
+            self.max_y = max_y
+
+    def add_text(self, text, insert, class_):
+        font_size = 14
+        if class_ == "min":
+            font_size = 10
+        if class_ == "time":
+            font_size = 5
+        width = len(text) * (font_size * 0.65)
+        height = font_size
+        size = (width, height)
+        self.add_rect(insert, size)
+        return size
+
+
+# Shapes of a layout, in drawing order. The class names are those of the
+# STYLES of the SvgPrinter.
+class LayoutRect:
+    __slots__ = ("x", "y", "width", "height", "class_name")
+
+    def __init__(self, x, y, width, height, class_name):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.class_name = class_name
+
+
+class LayoutText:
+    __slots__ = ("text", "x", "y", "class_name")
+
+    def __init__(self, text, x, y, class_name):
+        self.text = text
+        self.x = x
+        self.y = y
+        self.class_name = class_name
+
+
+# Rect of a build, for the links and tooltips of the HTML output
+class BuildArea:
+    __slots__ = ("build", "x", "y", "width", "height", "lane")
+
+    def __init__(self, build, x, y, width, height, lane):
+        self.build = build
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.lane = lane
+
+
+# Lines of the grid, every interval px from its left, count of them
+class GridLevel:
+    __slots__ = ("class_name", "interval", "count")
+
+    def __init__(self, class_name, interval, count):
+        self.class_name = class_name
+        self.interval = interval
+        self.count = count
+
+
+# Box behind the builds, with the levels of lines of the time axis, the
+# finest first, and their labels
+class GridLayout:
+    __slots__ = ("x", "y", "width", "height", "levels", "labels")
+
+    def __init__(self, x, y, width, height, levels, labels):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.levels = levels
+        self.labels = labels
+
+
+def format_tick(time, label_interval):
+    if label_interval >= HOUR:
+        return "%dh" % (time // HOUR)
+    if label_interval >= MINUTE or time % MINUTE == 0:
+        return "%dmin" % (time // MINUTE)
+    if time < MINUTE:
+        return "%ds" % (time // SECOND)
+    return "%dmin %ds" % (time // MINUTE, time % MINUTE // SECOND)
+
+
+# Time axis of a scale in px per minute: lines as close as readable, labels
+# on some of them, and stressed lines at the next round unit
+class TimeAxis:
+    def __init__(self, minute_width):
+        self.minute_width = minute_width
+
+        ms_width = minute_width / MINUTE
+        self.tick_interval = TICK_INTERVALS[-1]
+        for interval in TICK_INTERVALS:
+            if interval * ms_width >= MIN_TICK_WIDTH:
+                self.tick_interval = interval
+                break
+
+        self.label_interval = self.tick_interval
+        for interval in TICK_INTERVALS:
+            if (
+                interval >= self.tick_interval
+                and interval % self.tick_interval == 0
+                and interval * ms_width >= MIN_LABEL_WIDTH
+            ):
+                self.label_interval = interval
+                break
+
+        self.stress_interval = None
+        for interval in STRESS_INTERVALS:
+            if interval > self.label_interval and interval % self.label_interval == 0:
+                self.stress_interval = interval
+                break
+
+    # Grid with lines up to duration (excluded), in ms
+    def get_grid(self, x, y, width, height, duration):
+        levels = []
+        labels = []
+
+        ticks = int(duration / self.tick_interval + 1e-9)
+        if ticks > 0:
+            end = ticks * self.tick_interval
+            for class_name, interval in [
+                ("min01", self.tick_interval),
+                ("min5", self.label_interval),
+                ("min60", self.stress_interval),
+            ]:
+                if interval is None:
+                    continue
+                count = -(-end // interval)
+                px_interval = interval / MINUTE * self.minute_width
+                levels.append(GridLevel(class_name, px_interval, count))
+
+            px_interval = self.label_interval / MINUTE * self.minute_width
+            for i in range(levels[1].count):
+                labels.append(
+                    LayoutText(
+                        format_tick(i * self.label_interval, self.label_interval),
+                        x + i * px_interval,
+                        y - 5,
+                        "min",
+                    )
+                )
+
+        return GridLayout(x, y, width, height, tuple(levels), tuple(labels))
+
+
+# Everything the outputs draw, computed once by LayoutBuilder
+class Layout:
+    __slots__ = ("width", "height", "grid", "shapes", "builds", "lanes")
+
+    def __init__(self, width, height, grid, shapes, builds, lanes):
+        self.width = width
+        self.height = height
+        self.grid = grid
+        self.shapes = shapes
+        self.builds = builds
+        self.lanes = lanes
+
+
+# Compute the layout of the builds of a job_info in a single pass, with the
+# options of a SvgPrinter: lanes of the builds, then rects and labels of
+# their queue, execution and sections, and the size of the grid.
+#
+# Builds in progress are drawn up to the end of the grid, which is only known
+# once all the builds are laid out: their rects are widened at the end.
+class LayoutBuilder:
+    def __init__(self, printer, critical_path=None):
+        self.printer = printer
+        self.job_info = printer.job_info
+        self.critical_path = critical_path
+
+        self.base_timestamp = None
+        self.minute_width = printer.minute_width
+
+        self.shapes = []
+        self.build_areas = {}
+        self.lanes = {}
+        self.build_lanes = {}
+        self.__lane_allocator = None
+        # Rects of the builds in progress, with their offset in minutes
+        self.__in_progress = []
+
+    def __determine_index(self, build, index, boundary_box, x):
+        if build.lane_index is not None:
+            index = build.lane_index
+        else:
+            index = self.__determine_next_lane(build, index, x)
+        if index not in self.lanes:
+            self.lanes[index] = []
+        self.lanes[index].append(boundary_box)
+        self.build_lanes[build] = index
+        if self.__lane_allocator is not None:
+            self.__lane_allocator.add(index, boundary_box)
+
+        return index
+
+    def __determine_next_lane(self, build, index, x):
+        index_mode = self.printer.index_mode
+        next_index = None
+
+        if index_mode == "stairs":
+            if index is None:
+                next_index = 0
+            else:
+                next_index = index + 1
+
+        if index_mode == "compact":
+            next_index = self.__lane_allocator.allocate(x)
+
+        if index_mode == "upstream":
+            next_index = self.__lane_allocator.allocate(
+                x, self.build_lanes.get(build.upstream, 0)
+            )
+
+        if next_index is None:
+            raise Exception("Unknown index mode %s" % index_mode)
+
+        logger.debug("Next index: Index %s w/ x=%s => Next %s", index, x, next_index)
+        return next_index
+
+    # All the sections of a build at once, computed on the arrays of the
+    # SectionStore
+    def __add_sections(self, build, build_index):
+        printer = self.printer
+        sections = build.sections
+
+        start = numpy.frombuffer(sections.start, dtype=numpy.int64)
+        end = numpy.frombuffer(sections.end, dtype=numpy.int64)
+        depth = numpy.frombuffer(sections.depth, dtype=numpy.int32)
+        parent = numpy.frombuffer(sections.parent, dtype=numpy.int32)
+
+        # Sections not ended last until their closest ended parent, or until
+        # the end of the build for top-level ones. An end marker without a time
+        # (0) does not end a section either.
+        has_end = end > 0
+        parent_end = numpy.full(len(sections), NO_TIME, dtype=numpy.int64)
+        for level in range(1, depth.max() + 1):
+            indexes = numpy.nonzero(depth == level)[0]
+            parents = parent[indexes]
+            parent_end[indexes] = numpy.where(
+                has_end[parents], end[parents], parent_end[parents]
+            )
+        stop = numpy.where(has_end, end, parent_end)
+        if build.end:
+            stop[~has_end & (parent < 0)] = build.end
+
+        duration = stop - start
+        duration[(start == NO_TIME) | (stop == NO_TIME) | (has_end & (start == 0))] = 0
+
+        offset = numpy.maximum((start - self.base_timestamp) / 1000 / 60, 0)
+        x = printer.margin + offset * self.minute_width
+        width = duration / 1000 / 60 * self.minute_width
+        height = (1 + numpy.minimum(depth, 4)) * printer.section_height
+
+        class_names = ["type_%s" % section_type for section_type in sections.types]
+        class_names.append("type")
+
+        y = printer.margin + build_index * printer.build_height
+        y += printer.build_height - printer.build_padding
+
+        for section_x, section_width, section_height, type_id in zip(
+            x.tolist(), width.tolist(), height.tolist(), sections.type_id
+        ):
+            self.shapes.append(
+                LayoutRect(
+                    section_x, y, section_width, section_height, class_names[type_id]
+                )
+            )
+
+    def __add_queue(self, build, build_index, boundary_box):
+        printer = self.printer
+
+        if not printer.show_queue:
+            return None
+        if build.queueing_duration is None:
+            return None
+
+        offset = (
+            (build.start - build.queueing_duration - self.base_timestamp) / 1000 / 60
+        )
+        x = printer.margin + offset * self.minute_width
+        width = build.queueing_duration / 1000 / 60 * self.minute_width
+
+        build_index = self.__determine_index(build, build_index, boundary_box, x)
+
+        y = printer.margin + build_index * printer.build_height + printer.build_padding
+        height = printer.build_height - 2 * printer.build_padding
+
+        boundary_box.add_rect(insert=(x, y), size=(width, height))
+        self.shapes.append(LayoutRect(x, y, width, height, "queue"))
+
+        return build_index
+
+    def __add_build(self, build, index, boundary_box):
+        printer = self.printer
+
+        offset = 0
+        if build.start:
+            offset = (build.start - self.base_timestamp) / 1000 / 60
+
+        x = printer.margin + offset * self.minute_width
+
+        logger.debug("Laying out build %s in lane %s (x=%s)", build, index, x)
+
+        queue_index = self.__add_queue(build, index, boundary_box)
+        if queue_index is None:
+            index = self.__determine_index(build, index, boundary_box, x)
+        else:
+            index = queue_index
+
+        # The width of builds in progress is known at the end
+        duration = build.duration / 1000 / 60
+        if build.result == "IN_PROGRESS":
+            duration = 0
+        width = max(duration * self.minute_width, printer.min_width)
+
+        class_name = "other"
+        if build.result == "SUCCESS":
+            class_name = "success"
+        elif build.result == "ABORTED":
+            class_name = "aborted"
+        elif build.result == "INFRA_FAILURE":
+            class_name = "infra_failure"
+        elif build.result == "FAILURE":
+            class_name = "failure"
+        elif build.result == "UNSTABLE":
+            class_name = "unstable"
+        elif build.result == "IN_PROGRESS":
+            class_name = "in_progress"
+
+        if build.job_type in ["pipeline", "buildFlow", "matrixBuild", "matrixRun"]:
+            class_name = "pipe_%s" % class_name
+
+        y = printer.margin + index * printer.build_height
+        height = printer.build_height - 2 * printer.build_padding
+
+        build_id = "%s#%s" % (build.job_name, build.build_number)
+
+        rect = LayoutRect(x, y + printer.build_padding, width, height, class_name)
+        self.build_areas[build_id] = BuildArea(
+            build, x, y + printer.build_padding, width, height, index
+        )
+        boundary_box.add_rect(insert=(rect.x, rect.y), size=(width, height))
+        self.shapes.append(rect)
+        if build.result == "IN_PROGRESS":
+            self.__in_progress.append((rect, build_id, offset, build.duration))
+
+        if build.sections:
+            self.__add_sections(build, index)
+
+        if printer.show_build_name:
+            build_info = ""
+            if build.stage:
+                build_info = "[%s] " % build.stage
+            build_info += build_id
+
+            text_pos = (x + 5, y + printer.build_height - printer.build_padding - 8)
+            boundary_box.add_text(build_info, insert=text_pos, class_="min")
+            self.shapes.append(LayoutText(build_info, *text_pos, "min"))
+
+        if printer.show_time:
+            queue_time = get_human_time(build.queueing_duration)
+            exec_time = get_human_time(build.duration)
+            build_time = "[queue: %s; build: %s]" % (queue_time, exec_time)
+
+            text_pos = (x + 5, y + printer.build_height - printer.build_padding - 1)
+            boundary_box.add_text(build_time, insert=text_pos, class_="time")
+            self.shapes.append(LayoutText(build_time, *text_pos, "time"))
+
+        return index
+
+    def __add_builds(self):
+        printer = self.printer
+        index = None
+
+        if printer.index_mode == "compact":
+            self.__lane_allocator = CompactLanes()
+        elif printer.index_mode == "upstream":
+            self.__lane_allocator = UpstreamLanes()
+
+        # Boxes start with the queue, if shown
+        def sort_build(build):
+            if build.lane_index is not None:
+                return build.lane_index
+            if printer.show_queue and build.queueing_duration is not None:
+                return build.start - build.queueing_duration
+            return build.start
+
+        all_builds = self.job_info.all_builds
+        if printer.index_mode != "stairs":
+            all_builds = sorted(all_builds, key=sort_build)
+
+        for build in all_builds:
+            boundary_box = BoundaryBox(build)
+            index = self.__add_build(build, index, boundary_box)
+
+    # Builds in progress last until the end of the grid
+    def __widen_in_progress(self, minutes):
+        printer = self.printer
+
+        for rect, build_id, offset, duration in self.__in_progress:
+            duration = min(duration / 1000 / 60, minutes - offset)
+            rect.width = max(duration * self.minute_width, printer.min_width)
+            self.build_areas[build_id].width = rect.width
+
+    # Bar over the top of the builds, for each segment of the critical path
+    def __add_critical_path(self):
+        printer = self.printer
+
+        for segment in self.critical_path.segments:
+            build = segment.build
+            build_id = "%s#%s" % (build.job_name, build.build_number)
+            area = self.build_areas.get(build_id)
+            if area is None or area.build is not build:
+                continue
+
+            offset = (segment.start - self.base_timestamp) / 1000 / 60
+            duration = segment.duration / 1000 / 60
+
+            class_name = "critical"
+            if segment.kind == "queue":
+                class_name = "critical_queue"
+
+            self.shapes.append(
+                LayoutRect(
+                    printer.margin + offset * self.minute_width,
+                    area.y - 2,
+                    duration * self.minute_width,
+                    4,
+                    class_name,
+                )
+            )
+
+    # Scale fitting the builds in the target width of the printer
+    def __get_minute_width(self):
+        printer = self.printer
+        if not printer.target_width:
+            return printer.minute_width
+
+        end = self.base_timestamp + MINUTE
+        for build in self.job_info.all_builds:
+            if build.start:
+                end = max(end, build.start + build.duration)
+        return printer.target_width / ((end - self.base_timestamp) / MINUTE)
+
+    def build(self):
+        printer = self.printer
+
+        self.base_timestamp = self.job_info.start
+        self.minute_width = self.__get_minute_width()
+
+        self.__add_builds()
+
+        # Height based on number of lanes
+        box_height = printer.build_height * len(self.lanes)
+        height = 2 * printer.margin + box_height
+
+        # Width based on largest lane
+        max_x = 0
+        for lane in self.lanes:
+            if self.lanes[lane][-1].max_x > max_x:
+                max_x = self.lanes[lane][-1].max_x
+        minutes = int(max_x / self.minute_width)
+
+        box_width = max(max_x, printer.min_width)
+        width = 2 * printer.margin + box_width + printer.extra_width
+
+        logger.debug("Total: %d x %d", height, width)
+
+        self.__widen_in_progress(minutes)
+        if self.critical_path is not None:
+            self.__add_critical_path()
+
+        axis = TimeAxis(self.minute_width)
+        grid = axis.get_grid(
+            printer.margin,
+            printer.margin,
+            box_width,
+            box_height,
+            max_x / self.minute_width * MINUTE,
+        )
+        return Layout(
+            width,
+            height,
+            grid,
+            tuple(self.shapes),
+            tuple(self.build_areas.values()),
+            len(self.lanes),
+        )
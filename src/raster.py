@@ -0,0 +1,167 @@
+import math
+import re
+
+from .layout import LayoutText
+
+RULE_PATTERN = re.compile(r"(?P<selector>[\w.]+)\s*\{(?P<declarations>[^}]*)\}")
+RGB_PATTERN = re.compile(r"rgb\((\d+),\s*(\d+),\s*(\d+)\)")
+
+
+# Properties of each 'element.class' selector of a style sheet like STYLES,
+# the properties of 'element' included
+def parse_styles(css):
+    rules = {}
+    for match in RULE_PATTERN.finditer(css):
+        properties = {}
+        for declaration in match.group("declarations").split(";"):
+            name, _, value = declaration.partition(":")
+            if value:
+                properties[name.strip()] = value.strip()
+        rules[match.group("selector")] = properties
+
+    styles = {}
+    for selector, properties in rules.items():
+        element, _, _ = selector.partition(".")
+        styles[selector] = dict(rules.get(element, {}), **properties)
+    return styles
+
+
+def parse_color(value):
+    match = RGB_PATTERN.match(value)
+    if match is not None:
+        return tuple(int(component) / 255 for component in match.groups())
+    if value.startswith("#") and len(value) == 7:
+        return tuple(component / 255 for component in bytes.fromhex(value[1:]))
+    return (0, 0, 0)
+
+
+def _size(value):
+    return float(value.rstrip("px"))
+
+
+# Draw a Layout on a cairo image surface in memory, with the colors of the
+# classes of a style sheet, instead of converting an SVG of it.
+#
+# Only a view of the layout may be drawn, as (x, y, width, height) in the
+# coordinates of the layout, at a scale.
+#
+# RasterPrinter(layout, STYLES).print_png("build.png")
+class RasterPrinter:
+    def __init__(self, layout, styles, view=None, scale=1):
+        self.layout = layout
+        self.styles = parse_styles(styles)
+        self.view = view or (0, 0, layout.width, layout.height)
+        self.scale = scale
+
+        self.__context = None
+
+    def __get_style(self, element, class_name):
+        return self.styles.get(
+            "%s.%s" % (element, class_name), self.styles.get(element, {})
+        )
+
+    def __set_color(self, style, prefix, default="none"):
+        color = style.get(prefix, default)
+        if color == "none":
+            return False
+
+        opacity = float(style.get("%s-opacity" % prefix, 1))
+        if opacity <= 0:
+            return False
+
+        self.__context.set_source_rgba(*parse_color(color), opacity)
+        return True
+
+    def __draw_rect(self, x, y, width, height, class_name):
+        if width <= 0 or height <= 0:
+            return
+
+        context = self.__context
+        style = self.__get_style("rect", class_name)
+
+        context.rectangle(x, y, width, height)
+        if self.__set_color(style, "fill", "rgb(0,0,0)"):
+            context.fill_preserve()
+        if self.__set_color(style, "stroke"):
+            context.set_line_width(_size(style.get("stroke-width", "1")))
+            context.stroke_preserve()
+        context.new_path()
+
+    def __draw_line(self, x1, y1, x2, y2, class_name):
+        context = self.__context
+        style = self.__get_style("line", class_name)
+
+        if self.__set_color(style, "stroke"):
+            context.set_line_width(_size(style.get("stroke-width", "1")))
+            context.move_to(x1, y1)
+            context.line_to(x2, y2)
+            context.stroke()
+
+    def __draw_text(self, text, x, y, class_name):
+        context = self.__context
+        style = self.__get_style("text", class_name)
+
+        family = style.get("font-family", "sans-serif").split(",")[0].strip()
+        context.select_font_face(family)
+        context.set_font_size(_size(style.get("font-size", "14px")))
+        if style.get("text-anchor") == "end":
+            x -= context.text_extents(text)[4]
+
+        self.__set_color(style, "fill", "rgb(0,0,0)")
+        context.move_to(x, y)
+        context.show_text(text)
+        context.new_path()
+
+    def __draw_grid(self, grid):
+        self.__draw_rect(grid.x, grid.y, grid.width, grid.height, "box")
+
+        # Lines and labels in the view only
+        view_x, _, view_width, _ = self.view
+        for level in grid.levels:
+            first = max(0, math.ceil((view_x - 2 - grid.x) / level.interval))
+            last = min(
+                level.count - 1, (view_x + view_width + 2 - grid.x) // level.interval
+            )
+            for i in range(first, int(last) + 1):
+                x = grid.x + i * level.interval
+                self.__draw_line(x, grid.y, x, grid.y + grid.height, level.class_name)
+
+        for label in grid.labels:
+            if view_x - 100 <= label.x <= view_x + view_width:
+                self.__draw_text(label.text, label.x, label.y, label.class_name)
+
+    def draw(self):
+        layout = self.layout
+        view_x, view_y, view_width, view_height = self.view
+        width = int(math.ceil(view_width * self.scale))
+        height = int(math.ceil(view_height * self.scale))
+
+        # Only drawing needs libcairo, parse_styles() is used without it
+        import cairocffi
+
+        surface = cairocffi.ImageSurface(cairocffi.FORMAT_ARGB32, width, height)
+        self.__context = cairocffi.Context(surface)
+        self.__context.scale(self.scale, self.scale)
+        self.__context.translate(-view_x, -view_y)
+
+        self.__draw_rect(view_x, view_y, view_width, view_height, "background")
+        self.__draw_grid(layout.grid)
+
+        for shape in layout.shapes:
+            if isinstance(shape, LayoutText):
+                self.__draw_text(shape.text, shape.x, shape.y, shape.class_name)
+            else:
+                self.__draw_rect(
+                    shape.x, shape.y, shape.width, shape.height, shape.class_name
+                )
+
+        self.__context = None
+        return surface
+
+    # Output to a path or a binary stream, or returned as bytes without one
+    def print_png(self, output=None):
+        surface = self.draw()
+        try:
+            return surface.write_to_png(output)
+        finally:
+            surface.finish()
@@ -0,0 +1,198 @@
+import io
+import logging
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from .cache import MemoryCache
+from .job_info import BuildNotFoundException
+from .svg_printer import SvgPrinter
+
+logger = logging.getLogger(__name__)
+
+# /job/<name>/<build>.<format>, the name of jobs in folders being like
+# 'folder/job/name'
+PATH_PATTERN = re.compile(r"^/job/(?P<job>.+)/(?P<build>[^/]+)\.(?P<format>\w+)$")
+
+CONTENT_TYPES = {
+    "svg": "image/svg+xml",
+    "png": "image/png",
+    "html": "text/html; charset=utf-8",
+}
+
+
+class ServerBusyException(Exception):
+    pass
+
+
+# Calls of a function for the same key while a call for it is running wait
+# for that call and get its result, or its exception, instead of calling it
+# again.
+class SingleFlight:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # key -> [done event, result, exception]
+        self.__calls = {}
+
+    def do(self, key, function):
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = [threading.Event(), None, None]
+                self.__calls[key] = call
+
+        if leader:
+            try:
+                call[1] = function()
+            except Exception as ex:
+                call[2] = ex
+            finally:
+                with self.__lock:
+                    del self.__calls[key]
+                call[0].set()
+        else:
+            call[0].wait()
+
+        if call[2] is not None:
+            raise call[2]
+        return call[1]
+
+
+# Fetch and render builds on demand, for the requests of a server.
+#
+# Each build is fetched by a new fetcher, returned by create_fetcher(), so
+# that concurrent requests do not share builds being fetched: the fetchers
+# should share a cache instead (see MemoryCache). Concurrent requests for the
+# same build are coalesced into a single fetch, and for the same output into
+# a single rendering. At most 'concurrency' builds are fetched or rendered at
+# once, other requests failing with ServerBusyException after waiting
+# 'timeout' seconds for their turn.
+#
+# Outputs of completed builds are kept in memory, up to about cache_size
+# bytes. Builds in progress are fetched again for each request.
+#
+# configure is called with the SvgPrinter of each output, to set its options.
+class BuildRenderer:
+    def __init__(
+        self,
+        create_fetcher,
+        configure=None,
+        concurrency=4,
+        cache_size=256 * 1024 * 1024,
+        timeout=60.0,
+    ):
+        self.create_fetcher = create_fetcher
+        self.configure = configure
+        self.timeout = timeout
+
+        self.outputs = MemoryCache(max_size=cache_size)
+
+        self.__slots = threading.BoundedSemaphore(concurrency)
+        self.__fetches = SingleFlight()
+        self.__renders = SingleFlight()
+
+    def __fetch(self, job_name, build_number):
+        fetcher = self.create_fetcher()
+        try:
+            return fetcher.get_build(job_name, build_number, fetch_sections=True)
+        finally:
+            fetcher.close()
+
+    def __print(self, build_info, output_format):
+        printer = SvgPrinter(build_info)
+        if self.configure is not None:
+            self.configure(printer)
+
+        if output_format == "png":
+            return printer.print_png()
+
+        output = io.BytesIO()
+        if output_format == "svg":
+            printer.print_svg(output)
+        else:
+            printer.print_html(output)
+        return output.getvalue()
+
+    def __render(self, job_name, build_number, output_format):
+        if not self.__slots.acquire(timeout=self.timeout):
+            raise ServerBusyException("Too many builds being rendered")
+
+        try:
+            build_info = self.__fetches.do(
+                (job_name, build_number),
+                lambda: self.__fetch(job_name, build_number),
+            )
+            content = self.__print(build_info, output_format)
+        finally:
+            self.__slots.release()
+
+        # Outputs of permalinks are not cached, they move on to other builds
+        if build_info.is_done and build_number.isdigit():
+            self.outputs.set_decoded(
+                (job_name, build_number, output_format), None, content
+            )
+        return content
+
+    # Content of a build in one of CONTENT_TYPES, fetched and rendered unless
+    # it is cached
+    def render(self, job_name, build_number, output_format):
+        key = (job_name, build_number, output_format)
+        content = self.outputs.get_decoded(key, None)
+        if content is not None:
+            return content
+
+        return self.__renders.do(
+            key, lambda: self.__render(job_name, build_number, output_format)
+        )
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = "jenkins-build-analyzer"
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+    def __send(self, status, content, content_type="text/plain; charset=utf-8"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        match = PATH_PATTERN.match(self.path.split("?", 1)[0])
+        if match is None or match.group("format") not in CONTENT_TYPES:
+            self.__send(404, b"Not found: /job/<name>/<build>.{svg,png,html}\n")
+            return
+
+        output_format = match.group("format")
+        try:
+            content = self.server.renderer.render(
+                unquote(match.group("job")), match.group("build"), output_format
+            )
+        except BuildNotFoundException as ex:
+            self.__send(404, ("%s\n" % ex).encode("utf-8"))
+        except ServerBusyException as ex:
+            self.__send(503, ("%s\n" % ex).encode("utf-8"))
+        except Exception:
+            logger.exception("Unable to render '%s'", self.path)
+            self.__send(500, b"Unable to render the build\n")
+        else:
+            self.__send(200, content, CONTENT_TYPES[output_format])
+
+
+# Serve the outputs of a BuildRenderer until interrupted
+def serve(renderer, host="127.0.0.1", port=8080):
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.renderer = renderer
+
+    logger.info("Serving on http://%s:%d/job/<name>/<build>.svg", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,460 @@
+import json
+import logging
+import mmap
+import struct
+import sys
+from array import array
+
+from .job_info import NO_TIME, BuildInfo, BuildInfoFetcher, SectionStore
+
+logger = logging.getLogger(__name__)
+
+# Snapshot of a fetched build tree, to render it again without Jenkins.
+#
+# The file is columnar: a header, then one array per field of the builds and
+# of their sections, then a table of the strings they refer to. Arrays are
+# little-endian and 8-byte aligned, so that they are read in place from a
+# memory mapping of the file.
+#
+# header:     magic, version, builds, sections, sub-builds, strings counts
+# builds:     start, duration, queueing duration, build number (int64),
+#             first sub-build, sub-builds count, first section, sections
+#             count (int32),
+#             job, build number string, stage, result, job type, description,
+#             node name, upstream job, upstream build, details (string ids)
+# sections:   start, end (int64), parent (int32), name, type (string ids)
+# sub-builds: build indexes (int32), the sub-builds of each build in a row
+# strings:    offsets (uint64), UTF-8 data
+#
+# Each build is stored once, even if it is a sub-build of several builds.
+# Indexes and string ids are -1 when there is none, and the first section of
+# builds whose sections are unknown too. Missing times are stored as NONE.
+MAGIC = b"JBAS"
+VERSION = 2
+HEADER = struct.Struct("<4sIQQQQ")
+NONE = -(2**63)
+
+BUILD_INT64_COLUMNS = ["start", "duration", "queueing_duration", "build_number"]
+BUILD_INT32_COLUMNS = [
+    "first_sub_build",
+    "sub_builds_cnt",
+    "first_section",
+    "sections_cnt",
+]
+BUILD_STRING_COLUMNS = [
+    "job_name",
+    "build_number_str",
+    "stage",
+    "result",
+    "job_type",
+    "description",
+    "node_name",
+    "upstream_job",
+    "upstream_build",
+    "details",
+]
+SECTION_INT64_COLUMNS = ["start", "end"]
+SECTION_INT32_COLUMNS = ["parent"]
+SECTION_STRING_COLUMNS = ["name", "type"]
+
+
+def _padding(size):
+    return -size % 8
+
+
+class _StringTable:
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def add(self, value):
+        if value is None:
+            return -1
+        value = str(value)
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[value] = string_id
+            self.strings.append(value)
+        return string_id
+
+    def columns(self):
+        offsets = array("Q", [0])
+        data = []
+        for value in self.strings:
+            encoded = value.encode("utf-8")
+            data.append(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+        return offsets, b"".join(data)
+
+
+def _time(value):
+    if value is None:
+        return NONE
+    return int(value)
+
+
+def _get_columns(build_info):
+    strings = _StringTable()
+    builds = {name: array("q") for name in BUILD_INT64_COLUMNS}
+    builds.update({name: array("i") for name in BUILD_INT32_COLUMNS})
+    builds.update({name: array("i") for name in BUILD_STRING_COLUMNS})
+    sections = {name: array("q") for name in SECTION_INT64_COLUMNS}
+    sections.update({name: array("i") for name in SECTION_INT32_COLUMNS})
+    sections.update({name: array("i") for name in SECTION_STRING_COLUMNS})
+    sub_builds = array("i")
+
+    # all_builds lists the builds reached from several builds several times
+    unique_builds = {}
+    for build in build_info.all_builds:
+        unique_builds.setdefault(id(build), build)
+    unique_builds = list(unique_builds.values())
+    indexes = {id(build): index for index, build in enumerate(unique_builds)}
+
+    for build in unique_builds:
+        builds["start"].append(_time(build.start))
+        builds["duration"].append(_time(build.duration))
+        builds["queueing_duration"].append(_time(build.queueing_duration))
+        builds["build_number"].append(build.build_number)
+
+        builds["first_sub_build"].append(len(sub_builds))
+        builds["sub_builds_cnt"].append(len(build.sub_builds or []))
+        sub_builds.extend(
+            indexes[id(sub_build)] for sub_build in build.sub_builds or []
+        )
+
+        if build.sections is None:
+            builds["first_section"].append(-1)
+            builds["sections_cnt"].append(-1)
+        else:
+            first_section = len(sections["start"])
+            builds["first_section"].append(first_section)
+            builds["sections_cnt"].append(len(build.sections))
+
+            store = build.sections
+            for time_column in ["start", "end"]:
+                sections[time_column].extend(
+                    NONE if time == NO_TIME else time
+                    for time in getattr(store, time_column)
+                )
+            sections["parent"].extend(store.parent)
+            sections["name"].extend(strings.add(name) for name in store.names)
+            sections["type"].extend(
+                -1 if type_id < 0 else strings.add(store.types[type_id])
+                for type_id in store.type_id
+            )
+
+        upstream_job = upstream_build = None
+        if build.upstream is not None:
+            upstream_job = build.upstream.job_name
+            upstream_build = build.upstream.build_number_str
+
+        details = {
+            "parameters": build.parameters,
+            "failure_causes": build.failure_causes,
+            "user": build.user,
+        }
+
+        builds["job_name"].append(strings.add(build.job_name))
+        builds["build_number_str"].append(strings.add(build.build_number_str))
+        builds["stage"].append(strings.add(build.stage))
+        builds["result"].append(strings.add(build.result))
+        builds["job_type"].append(strings.add(build.job_type))
+        builds["description"].append(strings.add(build.description))
+        builds["node_name"].append(strings.add(build.node_name))
+        builds["upstream_job"].append(strings.add(upstream_job))
+        builds["upstream_build"].append(strings.add(upstream_build))
+        builds["details"].append(strings.add(json.dumps(details)))
+
+    return builds, sections, sub_builds, strings
+
+
+def save_snapshot(build_info, path):
+    builds, sections, sub_builds, strings = _get_columns(build_info)
+    offsets, data = strings.columns()
+
+    columns = [builds[name] for name in BUILD_INT64_COLUMNS]
+    columns += [sections[name] for name in SECTION_INT64_COLUMNS]
+    columns.append(offsets)
+    columns += [builds[name] for name in BUILD_INT32_COLUMNS + BUILD_STRING_COLUMNS]
+    columns += [
+        sections[name] for name in SECTION_INT32_COLUMNS + SECTION_STRING_COLUMNS
+    ]
+    columns.append(sub_builds)
+
+    with open(path, "wb") as output:
+        output.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                len(builds["start"]),
+                len(sections["start"]),
+                len(sub_builds),
+                len(strings.strings),
+            )
+        )
+        output.write(json.dumps({"url": build_info.fetcher.url}).encode("utf-8"))
+        output.write(b"\n")
+        output.write(b"\0" * _padding(output.tell()))
+
+        for column in columns:
+            if sys.byteorder != "little":
+                column = array(column.typecode, column)
+                column.byteswap()
+            column.tofile(output)
+            output.write(b"\0" * _padding(output.tell()))
+
+        output.write(data)
+
+    logger.info(
+        "Snapshot of %d build(s) and %d section(s) saved to '%s'",
+        len(builds["start"]),
+        len(sections["start"]),
+        path,
+    )
+
+
+# Build of a snapshot, read from the mapped file when it is first used: its
+# info, its sections and its sub-builds are all there already
+class SnapshotBuildInfo(BuildInfo):
+    def __init__(self, *args, reader=None, index=None, **kwargs):
+        self.__reader = reader
+        self.__index = index
+        super(SnapshotBuildInfo, self).__init__(*args, **kwargs)
+
+    def _fetch_info(self, fatal=False):
+        if self._info_fetched:
+            return
+        self._info_fetched = True
+
+        reader = self.__reader
+        if reader is None:
+            # An upstream build that is not part of the snapshot
+            self._result = "UNKNOWN"
+            return
+
+        columns = reader.builds
+        index = self.__index
+
+        self._build_number = columns["build_number"][index]
+        self._start = _value(columns["start"][index])
+        self._duration = _value(columns["duration"][index])
+        self._queueing_duration = _value(columns["queueing_duration"][index])
+        self._result = reader.string(columns["result"][index])
+        self._job_type = reader.string(columns["job_type"][index])
+        self._description = reader.string(columns["description"][index])
+        self._node_name = reader.string(columns["node_name"][index])
+
+        details = json.loads(reader.string(columns["details"][index]))
+        self._parameters = details["parameters"]
+        self._failure_causes = details["failure_causes"]
+        self._user = details["user"]
+
+    def _fetch_sub_builds(self):
+        self._sub_builds = []
+        if self.__reader is None:
+            return
+
+        columns = self.__reader.builds
+        first = columns["first_sub_build"][self.__index]
+        for position in range(first, first + columns["sub_builds_cnt"][self.__index]):
+            self._sub_builds.append(
+                self.__reader.get_build(self.__reader.sub_builds[position])
+            )
+
+    def _determine_sections(self):
+        pass
+
+    def refresh(self):
+        pass
+
+    @property
+    def sections(self):
+        if self._sections is None and self.__reader is not None:
+            columns = self.__reader.builds
+            if columns["sections_cnt"][self.__index] >= 0:
+                self._sections = _load_sections(
+                    self.__reader,
+                    columns["first_section"][self.__index],
+                    columns["sections_cnt"][self.__index],
+                )
+        return self._sections
+
+    # As of the snapshot, even for builds that were in progress
+    @property
+    def duration(self):
+        self._fetch_info()
+        return self._duration
+
+    # The properties of BuildInfo that read its JSON
+    @property
+    def result(self):
+        self._fetch_info()
+        return self._result
+
+    @result.setter
+    def result(self, value):
+        BuildInfo.result.fset(self, value)
+
+    @property
+    def node_name(self):
+        self._fetch_info()
+        return self._node_name
+
+    @property
+    def user(self):
+        self._fetch_info()
+        return self._user
+
+    @user.setter
+    def user(self, value):
+        self._user = value
+
+
+# Columns of a snapshot, read in place from the mapped file.
+#
+# The builds are created as they are reached from the top build, and read
+# their fields from the columns when they are first used: the file stays
+# mapped as long as they are.
+class SnapshotReader:
+    def __init__(self, path, fetcher=None):
+        self.path = path
+
+        with open(path, "rb") as snapshot:
+            self.__map = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__view = memoryview(self.__map)
+
+        (
+            magic,
+            version,
+            builds_cnt,
+            sections_cnt,
+            sub_builds_cnt,
+            strings_cnt,
+        ) = HEADER.unpack_from(self.__map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("'%s' is not a build snapshot" % path)
+
+        self.builds_cnt = builds_cnt
+        self.sections_cnt = sections_cnt
+        self.strings_cnt = strings_cnt
+
+        start = HEADER.size
+        end = self.__map.find(b"\n", start)
+        self.meta = json.loads(self.__map[start:end].decode("utf-8"))
+        self.__offset = end + 1
+
+        self.builds = {}
+        self.sections = {}
+        for name in BUILD_INT64_COLUMNS:
+            self.builds[name] = self.__read("q", builds_cnt)
+        for name in SECTION_INT64_COLUMNS:
+            self.sections[name] = self.__read("q", sections_cnt)
+        self.__string_offsets = self.__read("Q", strings_cnt + 1)
+        for name in BUILD_INT32_COLUMNS + BUILD_STRING_COLUMNS:
+            self.builds[name] = self.__read("i", builds_cnt)
+        for name in SECTION_INT32_COLUMNS + SECTION_STRING_COLUMNS:
+            self.sections[name] = self.__read("i", sections_cnt)
+        self.sub_builds = self.__read("i", sub_builds_cnt)
+
+        start = self.__offset + _padding(self.__offset)
+        self.__strings = self.__view[start:]
+        self.__decoded = {}
+
+        if fetcher is None:
+            fetcher = BuildInfoFetcher(self.meta["url"], info_class=SnapshotBuildInfo)
+        self.fetcher = fetcher
+        self.__build_objects = {}
+
+    def __read(self, typecode, count):
+        start = self.__offset + _padding(self.__offset)
+        end = start + array(typecode).itemsize * count
+        view = self.__view[start:end]
+        self.__offset = end
+
+        if sys.byteorder != "little":
+            column = array(typecode, view.tobytes())
+            column.byteswap()
+            return column
+        return view.cast(typecode)
+
+    def string(self, string_id):
+        if string_id < 0:
+            return None
+
+        value = self.__decoded.get(string_id)
+        if value is None:
+            start = self.__string_offsets[string_id]
+            end = self.__string_offsets[string_id + 1]
+            value = str(self.__strings[start:end], "utf-8")
+            self.__decoded[string_id] = value
+        return value
+
+    # Build at an index, the same object each time
+    def get_build(self, index):
+        build = self.__build_objects.get(index)
+        if build is not None:
+            return build
+
+        columns = self.builds
+        build = SnapshotBuildInfo(
+            self.fetcher,
+            self.string(columns["job_name"][index]),
+            self.string(columns["build_number_str"][index]),
+            stage=self.string(columns["stage"][index]),
+            fetch_on_init=False,
+            reader=self,
+            index=index,
+        )
+        self.__build_objects[index] = build
+        self.fetcher.builds["%s #%s" % (build.job_name, build.build_number_str)] = build
+
+        # Usually the build that has it as sub-build, created before it
+        upstream_job = self.string(columns["upstream_job"][index])
+        if upstream_job is not None:
+            build.upstream = self.fetcher.lookup_build(
+                upstream_job, self.string(columns["upstream_build"][index])
+            )
+        return build
+
+    # Unmap the file, once the builds are not used anymore
+    def close(self):
+        for column in list(self.builds.values()) + list(self.sections.values()):
+            if isinstance(column, memoryview):
+                column.release()
+        for column in [self.__string_offsets, self.sub_builds]:
+            if isinstance(column, memoryview):
+                column.release()
+        self.__strings.release()
+        self.__view.release()
+        self.__map.close()
+
+
+def _value(value):
+    if value == NONE:
+        return None
+    return value
+
+
+def _load_sections(reader, first_section, sections_cnt):
+    columns = reader.sections
+
+    sections = SectionStore()
+    for index in range(first_section, first_section + sections_cnt):
+        sections.add(
+            reader.string(columns["name"][index]),
+            reader.string(columns["type"][index]),
+            columns["parent"][index],
+            _value(columns["start"][index]),
+            _value(columns["end"][index]),
+        )
+
+    return sections
+
+
+# Load the build tree of a snapshot, returns its top build. The other builds
+# and their fields are read from the file as they are used.
+def load_snapshot(path, fetcher=None):
+    reader = SnapshotReader(path, fetcher)
+    logger.info("Snapshot of %d build(s) loaded from '%s'", reader.builds_cnt, path)
+    return reader.get_build(0)
@@ -0,0 +1,167 @@
+import csv
+import json
+import logging
+from array import array
+
+import numpy
+
+from .job_info import NO_TIME, BuildNotFoundException
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = [50, 90, 99]
+
+FIELDS = ["job", "section", "type", "count", "mean", "p50", "p90", "p99", "trend"]
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+
+# Durations of the sections of many builds, by job, path of the section
+# (e.g. 'build/compile') and type.
+#
+# Only the durations are kept, in flat arrays, so that builds can be dropped
+# once added. Durations are in ms, trends in ms per day.
+class SectionStats:
+    def __init__(self):
+        self.keys = []
+        self.__key_ids = {}
+
+        self.key_id = array("i")
+        self.duration = array("q")
+        # Start of the build of the section, for trends
+        self.build_start = array("q")
+
+    def __len__(self):
+        return len(self.duration)
+
+    def __get_key_id(self, key):
+        key_id = self.__key_ids.get(key)
+        if key_id is None:
+            key_id = len(self.keys)
+            self.__key_ids[key] = key_id
+            self.keys.append(key)
+        return key_id
+
+    # Add the sections of a build and of its sub-builds
+    def add_build(self, build_info):
+        for build in build_info.all_builds:
+            sections = build.sections
+            if not sections:
+                continue
+
+            paths = []
+            for index, name in enumerate(sections.names):
+                parent = sections.parent[index]
+                if parent >= 0:
+                    name = "%s/%s" % (paths[parent], name)
+                paths.append(name)
+
+                start = sections.start[index]
+                end = sections.end[index]
+                if start <= 0 or end == NO_TIME or end < start:
+                    continue
+
+                key = (build.job_name, name, sections.get_type(index))
+                self.key_id.append(self.__get_key_id(key))
+                self.duration.append(end - start)
+                self.build_start.append(build.start or start)
+
+    # Statistics of each key, computed on all the durations at once: they
+    # are sorted by key then duration, so that each key is a slice of them.
+    def compute(self):
+        if not self.keys:
+            return []
+
+        key_id = numpy.frombuffer(self.key_id, dtype=numpy.int32)
+        duration = numpy.frombuffer(self.duration, dtype=numpy.int64)
+        build_start = numpy.frombuffer(self.build_start, dtype=numpy.int64)
+
+        order = numpy.lexsort((duration, key_id))
+        key_id = key_id[order]
+        duration = duration[order].astype(numpy.float64)
+        # Days since the first build, for the trends
+        days = (build_start[order] - build_start.min()) / MS_PER_DAY
+
+        counts = numpy.bincount(key_id, minlength=len(self.keys))
+        starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        present = counts > 0
+        counts, starts = counts[present], starts[present]
+
+        mean = numpy.add.reduceat(duration, starts) / counts
+
+        # Linear interpolation between the closest ranks, as numpy.percentile()
+        percentiles = []
+        for percentile in PERCENTILES:
+            rank = starts + (counts - 1) * percentile / 100
+            low = numpy.floor(rank).astype(numpy.int64)
+            high = numpy.ceil(rank).astype(numpy.int64)
+            percentiles.append(
+                duration[low] + (duration[high] - duration[low]) * (rank - low)
+            )
+
+        # Least squares slope of the durations over the days
+        sum_x = numpy.add.reduceat(days, starts)
+        sum_y = numpy.add.reduceat(duration, starts)
+        sum_xx = numpy.add.reduceat(days * days, starts)
+        sum_xy = numpy.add.reduceat(days * duration, starts)
+        variance = counts * sum_xx - sum_x * sum_x
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            trend = (counts * sum_xy - sum_x * sum_y) / variance
+        trend[variance <= 1e-9] = 0
+
+        rows = []
+        key_ids = numpy.nonzero(present)[0]
+        for i, key_index in enumerate(key_ids.tolist()):
+            job_name, section, section_type = self.keys[key_index]
+            row = {
+                "job": job_name,
+                "section": section,
+                "type": section_type,
+                "count": int(counts[i]),
+                "mean": round(float(mean[i]), 1),
+                "trend": round(float(trend[i]), 1),
+            }
+            for percentile, values in zip(PERCENTILES, percentiles):
+                row["p%d" % percentile] = round(float(values[i]), 1)
+            rows.append(row)
+
+        return rows
+
+    def write(self, output):
+        rows = self.compute()
+
+        with open(output, "w", newline="") as f_output:
+            if output.endswith(".json"):
+                json.dump(rows, f_output, indent=2)
+            else:
+                writer = csv.DictWriter(f_output, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+
+        logger.info("Statistics of %d section(s) written to '%s'", len(rows), output)
+
+
+# Walk builds with a fetcher, each build being dropped once its sections are
+# added, and return their statistics
+def collect_stats(fetcher, builds):
+    stats = SectionStats()
+
+    for job_name, build_number in builds:
+        try:
+            build_info = fetcher.get_build(job_name, build_number, fetch_sections=True)
+        except BuildNotFoundException as ex:
+            logger.warning(ex)
+            continue
+        except Exception:
+            # e.g. Jenkins still unreachable after the retries
+            logger.exception("Unable to fetch %s #%s", job_name, build_number)
+            continue
+
+        stats.add_build(build_info)
+        fetcher.forget_tree(build_info)
+
+        logger.info(
+            "%s #%s: %d section duration(s) so far", job_name, build_number, len(stats)
+        )
+
+    return stats
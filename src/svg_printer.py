@@ -1,12 +1,14 @@
-import svgwrite
 import logging
-import tempfile
-import cairosvg
+import io
 import base64
 import html
 import re
 
+from .critical_path import CriticalPath
+from .html_canvas import CanvasPrinter
 from .job_info import get_human_time
+from .layout import LayoutBuilder, LayoutText
+from .svg_writer import SvgWriter, open_output
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +38,9 @@ STYLES = """
       rect.pipe_other        { stroke: rgb(204,204,204); stroke-width: 5; stroke-opacity: 0.7; fill: rgb(204,204,204); fill-opacity: 0.3; }
       rect.pipe_in_progress  { stroke: rgb(135,205,222); stroke-width: 5; stroke-opacity: 0.7; fill: rgb(135,205,222); fill-opacity: 0.3; }
 
+      rect.critical       { fill: rgb(220,20,20); fill-opacity: 0.8; }
+      rect.critical_queue { fill: rgb(220,20,20); fill-opacity: 0.3; }
+
       rect.type         { fill: rgb(50,50,50); fill-opacity: 0.7; }
       rect.type_scm     { fill: rgb(255,208,147); fill-opacity: 0.7; }
       rect.type_docker  { fill: rgb(147,214,255); fill-opacity: 0.7; }
@@ -155,49 +160,6 @@ $(function() {
 </script>"""
 
 
-class BoundaryBox:
-    def __init__(self, obj, x=None, y=None, max_x=None, max_y=None):
-        self.obj = obj
-        self.x = x
-        self.y = y
-        self.max_x = max_x
-        self.max_y = max_y
-
-    def __str__(self):
-        return "Box %s: (x=%s, y=%s) -> (x=%s, y=%s)" % (
-            self.obj,
-            self.x,
-            self.y,
-            self.max_x,
-            self.max_y,
-        )
-
-    def add_rect(self, insert, size):
-        max_x = insert[0] + size[0]
-        max_y = insert[1] + size[1]
-        # logger.debug("Add rect x1%s width%s -> x2%s", insert, size, (max_x, max_y))
-        if self.x is None or insert[0] < self.x:
-            self.x = insert[0]
-        if self.y is None or insert[1] < self.y:
-            self.y = insert[1]
-        if self.max_x is None or self.max_x < max_x:
-            self.max_x = max_x
-        if self.max_y is None or self.max_y < max_y:
-            self.max_y = max_y
-
-    def add_text(self, text, insert, class_):
-        font_size = 14
-        if class_ == "min":
-            font_size = 10
-        if class_ == "time":
-            font_size = 5
-        width = len(text) * (font_size * 0.65)
-        height = font_size
-        size = (width, height)
-        self.add_rect(insert, size)
-        return size
-
-
 class SvgPrinter:
     def __init__(self, job_info):
         self.job_info = job_info
@@ -210,394 +172,188 @@ class SvgPrinter:
         self.show_queue = True
         self.show_time = False
         self.show_infobox = True
+        self.show_critical_path = False
 
         self.build_padding = 5
         self.build_height = 30
         self.section_height = 2
         self.minute_width = 10
+        # Width the time axis is scaled to, if any, instead of minute_width
+        self.target_width = None
         self.min_width = 5
-        self.base_timestamp = None
 
-        self.rect_builds = {}
-        self.box_height = None
-        self.box_width = None
-        self.total_height = None
-        self.total_width = None
         self.index_mode = "stairs"
-
-        self.__dwg = None
-        self.current_pos = None
-
-        self.all_builds = self.job_info.all_builds
-        self.build_result = self.job_info.result
-        self.duration = self.job_info.duration
-        self.max_duration = 0
-
-        self.boundary_boxes = {}
-        self.lanes = {}
-
-    def __determine_sizes(self):
-
-        self.base_timestamp = self.job_info.start
-
-        # First render pass to determine the sizes
-        self.__render_builds(render=False)
-
-        # Height based on number of lanes
-        self.box_height = self.build_height * len(self.lanes)
-        self.total_height = 2 * self.margin + self.box_height
-
-        # Width based on largest lane
-        max_x = 0
-        for lane in self.lanes:
-            if self.lanes[lane][-1].max_x > max_x:
-                max_x = self.lanes[lane][-1].max_x
-        self.max_duration = int(max_x / self.minute_width)
-
-        self.box_width = max_x
-        if self.box_width < self.min_width:
-            self.box_width = self.min_width
-        self.total_width = 2 * self.margin + self.box_width + self.extra_width
-
-        logger.debug("Total: %d x %d", self.total_height, self.total_width)
-
-    def __render_grid(self):
-        dwg = self.__dwg
-
-        self.current_pos = self.margin
-
-        dwg.add(
-            dwg.rect(
-                insert=(self.margin, self.margin),
-                size=(self.box_width, self.box_height),
-                class_="box",
+        # "image" of the timeline with an area per build, or "canvas"
+        self.html_mode = "image"
+        # Processes rendering tiles (default: CPUs)
+        self.processes = None
+
+        self.__writer = None
+
+        self.critical_path = None
+        self.layout = None
+
+    # Layout of the builds, computed once for all the outputs
+    def get_layout(self):
+        if self.layout is None:
+            critical_path = None
+            if self.show_critical_path:
+                if self.critical_path is None:
+                    self.critical_path = CriticalPath(self.job_info)
+                critical_path = self.critical_path
+            self.layout = LayoutBuilder(self, critical_path).build()
+        return self.layout
+
+    def __render_grid(self, grid):
+        writer = self.__writer
+
+        writer.rect(grid.x, grid.y, grid.width, grid.height, "box")
+
+        # Each level of lines is a rect filled with a pattern of one line, so
+        # that the size of the grid does not depend on the duration. The line
+        # is 1px away from the left of the tiles not to be clipped.
+        for level in grid.levels:
+            pattern_id = "grid-%s" % level.class_name
+            writer.line_pattern(
+                pattern_id,
+                grid.x - 1,
+                grid.y,
+                level.interval,
+                grid.height,
+                1,
+                level.class_name,
             )
-        )
-
-        for x in range(0, self.max_duration):
-
-            class_name = "min01"
-            if x % 5 == 0:
-                class_name = "min5"
-                if x % 60 == 0:
-                    class_name = "min60"
-
-                dwg.add(
-                    dwg.text(
-                        "%dmin" % x,
-                        insert=(self.current_pos, self.margin - 5),
-                        class_="min",
-                    )
-                )
-
-            dwg.add(
-                dwg.line(
-                    start=(self.current_pos, self.margin),
-                    end=(self.current_pos, self.total_height - self.margin),
-                    class_=class_name,
-                )
+            writer.pattern_rect(
+                grid.x - 1,
+                grid.y,
+                (level.count - 1) * level.interval + 2,
+                grid.height,
+                pattern_id,
             )
 
-            self.current_pos += self.minute_width
+        for label in grid.labels:
+            writer.text(label.text, label.x, label.y, label.class_name)
 
-    def __render_section(self, build, section, build_index, boundary_box, render):
-        dwg = self.__dwg
+    def __render_shapes(self, shapes):
+        writer = self.__writer
 
-        offset = (section.start - self.base_timestamp) / 1000 / 60
-        if offset < 0:
-            offset = 0
-        offset_px = offset * self.minute_width
-
-        duration = section.duration / 1000 / 60
-        if not section.end:
-            if not section.parent:
-                if build.end:
-                    duration = (build.end - section.start) / 1000 / 60
+        for shape in shapes:
+            if isinstance(shape, LayoutText):
+                writer.text(shape.text, shape.x, shape.y, shape.class_name)
             else:
-                parent_section = section.parent
-                while parent_section is not None:
-                    if parent_section.end:
-                        duration = (parent_section.end - section.start) / 1000 / 60
-                        break
-                    parent_section = parent_section.parent
-        duration_px = duration * self.minute_width
-
-        class_name = "type"
-        if section.type:
-            class_name = "type_%s" % section.type
-
-        section_index = section.parents_cnt
-        if section_index >= 4:
-            section_index = 4
-
-        x = self.margin + offset_px
-        y = self.margin + build_index * self.build_height
-
-        if render:
-            dwg.add(
-                dwg.rect(
-                    insert=(x, y + self.build_height - self.build_padding),
-                    size=(duration_px, (1 + section_index) * self.section_height),
-                    class_=class_name,
+                writer.rect(
+                    shape.x, shape.y, shape.width, shape.height, shape.class_name
                 )
-            )
-
-    def __determine_index(self, build, index, boundary_box, x):
-
-        if build.lane_index is not None:
-            index = build.lane_index
-        else:
-            index = self.__determine_next_lane(index, x)
-        if index not in self.lanes:
-            self.lanes[index] = []
-        self.lanes[index].append(boundary_box)
 
-        return index
-
-    def __render_queue(self, build, build_index, boundary_box, render):
-        dwg = self.__dwg
-
-        if not self.show_queue:
-            return None
-        if build.queueing_duration is None:
-            return None
-
-        offset = (
-            (build.start - build.queueing_duration - self.base_timestamp) / 1000 / 60
-        )
-        offset_px = offset * self.minute_width
-
-        duration = build.queueing_duration / 1000 / 60
-        duration_px = duration * self.minute_width
-
-        class_name = "queue"
-
-        x = self.margin + offset_px
+    # Output to a path, gzipped for '.svgz', or to a binary stream
+    def print_svg(self, output):
+        layout = self.get_layout()
 
-        build_index = self.__determine_index(build, build_index, boundary_box, x)
+        with open_output(output) as stream:
+            self.__writer = SvgWriter(stream)
+            writer = self.__writer
 
-        y = self.margin + build_index * self.build_height
+            # Add styles
+            writer.start(layout.width, layout.height, STYLES)
 
-        insert = (x, y + self.build_padding)
-        size = (duration_px, self.build_height - 2 * self.build_padding)
+            # Background
+            writer.rect(0, 0, "100%", "100%", "background")
 
-        boundary_box.add_rect(insert=insert, size=size)
-        if render:
-            dwg.add(
-                dwg.rect(
-                    insert=insert,
-                    size=size,
-                    class_=class_name,
-                )
-            )
+            # Render grid
+            self.__render_grid(layout.grid)
 
-        return build_index
+            # Render builds
+            self.__render_shapes(layout.shapes)
 
-    def __render_build(self, build, index, boundary_box=None, render=True):
-        dwg = self.__dwg
+            writer.end()
 
-        offset = 0
-        if build.start:
-            offset = (build.start - self.base_timestamp) / 1000 / 60
-        offset_px = offset * self.minute_width
+    # Drawn from the layout in memory: output to a path or a binary stream,
+    # or returned as bytes without one
+    def print_png(self, output=None):
+        # Needs libcairo, unlike the other outputs
+        from .raster import RasterPrinter
 
-        x = self.margin + offset_px
+        return RasterPrinter(self.get_layout(), STYLES).print_png(output)
 
-        logger.debug("Rendering build %s in lane %s (x=%s)", build, index, x)
+    # Directory of PNG tiles at several zoom levels, with a viewer of them
+    def print_tiles(self, output):
+        from .tiles import TilePrinter
 
-        queue_index = self.__render_queue(build, index, boundary_box, render)
-        if queue_index is None:
-            index = self.__determine_index(build, index, boundary_box, x)
-        else:
-            index = queue_index
-
-        duration = build.duration / 1000 / 60
-        if build.result == "IN_PROGRESS":
-            max_duration = self.max_duration - offset
-            if max_duration < duration:
-                duration = max_duration
-        duration_px = duration * self.minute_width
-        if duration_px < self.min_width:
-            duration_px = self.min_width
-
-        class_name = "other"
-        if build.result == "SUCCESS":
-            class_name = "success"
-        elif build.result == "ABORTED":
-            class_name = "aborted"
-        elif build.result == "INFRA_FAILURE":
-            class_name = "infra_failure"
-        elif build.result == "FAILURE":
-            class_name = "failure"
-        elif build.result == "UNSTABLE":
-            class_name = "unstable"
-        elif build.result == "IN_PROGRESS":
-            class_name = "in_progress"
-
-        if build.job_type in ["pipeline", "buildFlow", "matrixBuild", "matrixRun"]:
-            class_name = "pipe_%s" % class_name
-
-        y = self.margin + index * self.build_height
-
-        build_id = "%s#%s" % (build.job_name, build.build_number)
-
-        build_r = {
-            "build": build,
-            "insert": (x, y + self.build_padding),
-            "size": (duration_px, self.build_height - 2 * self.build_padding),
+        title = "%s #%s" % (self.job_info.job_name, self.job_info.build_number)
+        TilePrinter(
+            self.get_layout(), STYLES, html.escape(title), self.processes
+        ).print_tiles(output)
+
+    # Details of a build shown in its tooltip, escaped for HTML but the
+    # sections and failure causes
+    def get_build_details(self, build):
+        details = {
+            "url": build.build_url(),
+            "queue": get_human_time(build.queueing_duration),
+            "exec": get_human_time(build.duration),
+            "result": build.result,
         }
-        self.rect_builds[build_id] = build_r
-        boundary_box.add_rect(insert=build_r["insert"], size=build_r["size"])
-        if render:
-            dwg.add(
-                dwg.rect(
-                    insert=build_r["insert"], size=build_r["size"], class_=class_name
-                )
-            )
-
-        if build.sections:
+        if not self.show_build_name:
+            details["name"] = "%s#%s" % (build.job_name, build.build_number)
+        if self.critical_path is not None and build in self.critical_path.slack:
+            slack = self.critical_path.slack[build]
+            if slack == 0:
+                details["slack"] = "none (critical path)"
+            else:
+                details["slack"] = get_human_time(slack)
+        if build.description:
+            desc = build.description
+            desc = re.sub(r"<iframe.*<\/iframe>", "", desc)
+            desc = re.sub(r"<script.*<\/script>", "", desc)
+            details["description"] = desc
+
+        if len(build.failure_causes) != 0:
+            details["causes"] = [
+                (cause["name"], cause.get("description"))
+                for cause in build.failure_causes
+            ]
+
+        if build.sections and len(build.sections) != 0:
+            details["sections"] = []
             for section in build.sections:
-                self.__render_section(build, section, index, boundary_box, render)
-
-        if self.show_build_name:
-            build_info = ""
-            if build.stage:
-                build_info = "[%s] " % build.stage
-            build_info += build_id
-
-            text_pos = (x + 5, y + self.build_height - self.build_padding - 8)
-            boundary_box.add_text(build_info, insert=text_pos, class_="min")
-            if render:
-                dwg.add(
-                    dwg.text(
-                        build_info,
-                        insert=text_pos,
-                        class_="min",
-                    )
-                )
-
-        if self.show_time:
-            queue_time = get_human_time(build.queueing_duration)
-            exec_time = get_human_time(build.duration)
-            build_time = "[queue: %s; build: %s]" % (queue_time, exec_time)
-
-            text_pos = (x + 5, y + self.build_height - self.build_padding - 1)
-            boundary_box.add_text(build_time, insert=text_pos, class_="time")
-            if render:
-                dwg.add(
-                    dwg.text(
-                        build_time,
-                        insert=text_pos,
-                        class_="time",
-                    )
+                class_name = None
+                if section.end is None:
+                    class_name = "error"
+                elif section.duration < 60 * 1000:
+                    class_name = "short"
+                details["sections"].append(
+                    (section.parents_cnt, str(section), class_name)
                 )
+        return details
 
-        return index
-
-    def __determine_next_lane(self, index, x):
-        next_index = None
-
-        if self.index_mode == "stairs":
-            if index is None:
-                next_index = 0
-            else:
-                next_index = index + 1
-
-        if self.index_mode == "compact":
-            max_lane = None
-
-            for lane in self.lanes:
-                boundary_box = None
-                if len(self.lanes[lane]) != 0:
-                    boundary_box = self.lanes[lane][-1]
-                if boundary_box is None:
-                    # Lane is empty, select it
-                    max_lane = lane
-                    break
-                if x > boundary_box.max_x:
-                    # The start of our position is above the max of the last box on that lane, select it
-                    max_lane = lane
-                    break
-            else:
-                # If there is no space in the existing lanes, add a new one
-                max_lane = len(self.lanes)
-
-            next_index = max_lane
-
-        if next_index is None:
-            raise Exception("Unknown index mode %s" % self.index_mode)
-
-        logger.debug("Next index: Index %s w/ x=%s => Next %s", index, x, next_index)
-        return next_index
-
-    def __render_builds(self, render=True):
-        index = None
-        self.lanes = {}
-        self.boundary_boxes = {}
-
-        def sort_build(build):
-            if build.lane_index is not None:
-                return build.lane_index
-            return build.start
-
-        all_builds = self.all_builds
-        if self.index_mode != "stairs":
-            all_builds = sorted(self.all_builds, key=sort_build)
-
-        for build in all_builds:
-            boundary_box = BoundaryBox(build)
-            self.boundary_boxes[build] = boundary_box
-            index = self.__render_build(build, index, boundary_box, render)
-
-    def print_svg(self, output):
-        self.__determine_sizes()
-
-        self.__dwg = svgwrite.Drawing(
-            filename=output, size=(self.total_width, self.total_height), debug=True
-        )
-
-        dwg = self.__dwg
-
-        # Add styles
-        dwg.defs.add(dwg.style(STYLES))
-
-        # Background
-        dwg.add(dwg.rect(insert=(0, 0), size=("100%", "100%"), class_="background"))
-
-        # Render grid
-        self.__render_grid()
-
-        # Render builds
-        self.__render_builds()
-
-        # Save
-        dwg.save(pretty=True)
-
-    def print_svg_to_tmp(self):
-
-        # First print as svg in a temporary file
-        f = tempfile.NamedTemporaryFile(delete=True)
-        self.print_svg(f.name)
-
-        return f
-
-    def print_png(self, output):
-
-        # First print as svg in a temporary file
-        f = self.print_svg_to_tmp()
-
-        # Convert that file from svg to png
-        cairosvg.svg2png(url=f.name, write_to=output)
-
-        # Remove temporary file
-        f.close()
-
+    # Output to a path or a binary stream
     def print_html(self, output):
+        if self.html_mode == "canvas":
+            self.__print_html_canvas(output)
+        else:
+            self.__print_html_image(output)
 
-        # First print as svg in a temporary file
-        svg_content = None
-        with self.print_svg_to_tmp() as f_svg:
-            svg_content = f_svg.read()
+    # Shapes and builds as JSON, drawn on a canvas by the page
+    def __print_html_canvas(self, output):
+        title = "%s #%s" % (self.job_info.job_name, self.job_info.build_number)
+        builds = [
+            self.get_build_details(area.build) for area in self.get_layout().builds
+        ]
+        CanvasPrinter(
+            self.get_layout(),
+            STYLES,
+            builds,
+            html.escape(title),
+            self.result,
+            self.show_infobox,
+        ).print_html(output)
+
+    def __print_html_image(self, output):
+
+        # First print as svg in memory
+        svg_buffer = io.BytesIO()
+        self.print_svg(svg_buffer)
+        svg_content = svg_buffer.getvalue()
 
         title = "%s #%s" % (self.job_info.job_name, self.job_info.build_number)
 
@@ -607,62 +363,53 @@ class SvgPrinter:
 
         map_content = []
         tooltips_content = []
-        for build_r in self.rect_builds.values():
-            build = build_r["build"]
-            link = build.build_url()
+        for area in self.get_layout().builds:
+            build = area.build
+            details = self.get_build_details(build)
             tooltip_id = "tooltip-%s-%s" % (build.job_name, build.build_number)
             tooltip_id = tooltip_id.replace(".", "_")
-            area = (
+            map_content.append(
                 '<area shape="rect" coords="%d,%d,%d,%d" href="%s" data-tooltip="%s"/>'
                 % (
-                    build_r["insert"][0],
-                    build_r["insert"][1],
-                    build_r["insert"][0] + build_r["size"][0],
-                    build_r["insert"][1] + build_r["size"][1],
-                    link,
+                    area.x,
+                    area.y,
+                    area.x + area.width,
+                    area.y + area.height,
+                    details["url"],
                     "#" + tooltip_id,
                 )
             )
-            map_content.append(area)
 
-            queue_time = get_human_time(build.queueing_duration)
-            exec_time = get_human_time(build.duration)
             tooltip_lines = []
-            if not self.show_build_name:
-                tooltip_lines.append("<b>Build:</b> %s<br/>" % build)
-            tooltip_lines.append("<b>Queue Time:</b> %s<br/>" % queue_time)
-            tooltip_lines.append("<b>Exec Time:</b> %s<br/>" % exec_time)
-            tooltip_lines.append("<b>Result:</b> %s<br/>" % build.result)
-            if build.description:
-                desc = build.description
-                desc = re.sub(r"<iframe.*<\/iframe>", "", desc)
-                desc = re.sub(r"<script.*<\/script>", "", desc)
+            if "name" in details:
+                tooltip_lines.append("<b>Build:</b> %s<br/>" % details["name"])
+            tooltip_lines.append("<b>Queue Time:</b> %s<br/>" % details["queue"])
+            tooltip_lines.append("<b>Exec Time:</b> %s<br/>" % details["exec"])
+            tooltip_lines.append("<b>Result:</b> %s<br/>" % details["result"])
+            if "slack" in details:
+                tooltip_lines.append("<b>Slack:</b> %s<br/>" % details["slack"])
+            if "description" in details:
                 tooltip_lines.append(
-                    '<b>Description:</b><br/><div class="description">%s</div>' % (desc)
+                    '<b>Description:</b><br/><div class="description">%s</div>'
+                    % details["description"]
                 )
 
-            if len(build.failure_causes) != 0:
+            if "causes" in details:
                 tooltip_lines.append("<b>Failure Causes:</b><br/>")
-                for cause in build.failure_causes:
-                    tooltip_lines.append(
-                        "- <em>%s:</em><br/>" % html.escape(cause["name"])
-                    )
-                    if cause.get("description"):
+                for name, description in details["causes"]:
+                    tooltip_lines.append("- <em>%s:</em><br/>" % html.escape(name))
+                    if description:
                         tooltip_lines.append(
-                            '<p class="failure-cause">%s</p>'
-                            % html.escape(cause["description"])
+                            '<p class="failure-cause">%s</p>' % html.escape(description)
                         )
 
-            if build.sections and len(build.sections) != 0:
+            if "sections" in details:
                 tooltip_lines.append("<b>Sections:</b><br/>")
                 tooltip_lines.append('<div class="sections">')
-                for section in build.sections:
-                    padding = "&nbsp;" * section.parents_cnt * 2
-                    txt = section
-                    if section.end is None:
-                        txt = '<span class="error">%s</span>' % section
-                    elif section.duration < 60 * 1000:
-                        txt = '<span class="short">%s</span>' % section
+                for parents_cnt, txt, class_name in details["sections"]:
+                    padding = "&nbsp;" * parents_cnt * 2
+                    if class_name is not None:
+                        txt = '<span class="%s">%s</span>' % (class_name, txt)
                     tooltip_lines.append("%s⊩ %s<br/>" % (padding, txt))
                 tooltip_lines.append("</div>")
 
@@ -676,7 +423,7 @@ class SvgPrinter:
         if self.show_infobox:
             head_content += MAPHIGHLIGHT_SCRIPT
 
-        with open(output, "w") as f_html:
+        with open_output(output) as f_html:
             html_content = HTML_TMPL % (
                 title,
                 head_content,
@@ -689,17 +436,18 @@ class SvgPrinter:
 
     @property
     def result(self):
-        key = next(iter(self.rect_builds))
-        return self.rect_builds[key]["build"].result
+        return self.get_layout().builds[0].build.result
 
     def print(self, output):
         logger.debug("Output to %s", output)
 
-        if output.endswith(".svg"):
+        if output.endswith(".svg") or output.endswith(".svgz"):
             self.print_svg(output)
         elif output.endswith(".png"):
             self.print_png(output)
         elif output.endswith(".html") or output.endswith(".htm"):
             self.print_html(output)
+        elif output.endswith(".tiles"):
+            self.print_tiles(output)
         else:
             raise Exception("Format not supported")
@@ -0,0 +1,97 @@
+import contextlib
+import gzip
+import io
+from xml.sax.saxutils import escape
+
+HEADER = (
+    '<?xml version="1.0" encoding="utf-8" ?>\n'
+    '<svg xmlns="http://www.w3.org/2000/svg" '
+    'xmlns:ev="http://www.w3.org/2001/xml-events" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink" '
+    'baseProfile="full" height="%s" version="1.1" width="%s">\n'
+)
+
+
+# Coordinates, to the thousandth of a pixel
+def _number(value):
+    if isinstance(value, (int, str)):
+        return str(value)
+    return repr(round(float(value), 3))
+
+
+# Text stream to an output path, gzipped for '.svgz', or to a binary stream
+@contextlib.contextmanager
+def open_output(output):
+    if hasattr(output, "write"):
+        stream = io.TextIOWrapper(output, encoding="utf-8")
+        try:
+            yield stream
+        finally:
+            stream.flush()
+            stream.detach()
+    elif output.endswith(".svgz"):
+        with gzip.open(output, "wt", encoding="utf-8", compresslevel=6) as stream:
+            yield stream
+    else:
+        with open(output, "w", encoding="utf-8") as stream:
+            yield stream
+
+
+# Write SVG elements straight to a text stream, one per line, without
+# building a tree of them nor validating them as svgwrite does.
+#
+# with open_output("build.svgz") as stream:
+#     writer = SvgWriter(stream)
+#     writer.start(100, 50, STYLES)
+#     writer.rect(0, 0, 10, 10, "success")
+#     writer.end()
+class SvgWriter:
+    def __init__(self, stream):
+        self.write = stream.write
+
+    def start(self, width, height, styles=None):
+        self.write(HEADER % (_number(height), _number(width)))
+        if styles is not None:
+            self.write(
+                '<defs>\n<style type="text/css"><![CDATA[%s]]></style>\n</defs>\n'
+                % styles
+            )
+
+    def end(self):
+        self.write("</svg>\n")
+
+    def rect(self, x, y, width, height, class_name):
+        self.write(
+            '<rect class="%s" height="%s" width="%s" x="%s" y="%s"/>\n'
+            % (class_name, _number(height), _number(width), _number(x), _number(y))
+        )
+
+    # Rect filled with a pattern
+    def pattern_rect(self, x, y, width, height, pattern_id):
+        self.write(
+            '<rect fill="url(#%s)" height="%s" width="%s" x="%s" y="%s"/>\n'
+            % (pattern_id, _number(height), _number(width), _number(x), _number(y))
+        )
+
+    # Pattern of vertical lines, every width px from x, the line being at
+    # line_x in the tile
+    def line_pattern(self, pattern_id, x, y, width, height, line_x, class_name):
+        self.write(
+            '<defs>\n<pattern height="%s" id="%s" patternUnits="userSpaceOnUse" '
+            'width="%s" x="%s" y="%s">\n'
+            % (_number(height), pattern_id, _number(width), _number(x), _number(y))
+        )
+        self.line(line_x, 0, line_x, height, class_name)
+        self.write("</pattern>\n</defs>\n")
+
+    def line(self, x1, y1, x2, y2, class_name):
+        self.write(
+            '<line class="%s" x1="%s" x2="%s" y1="%s" y2="%s"/>\n'
+            % (class_name, _number(x1), _number(x2), _number(y1), _number(y2))
+        )
+
+    def text(self, text, x, y, class_name):
+        self.write(
+            '<text class="%s" x="%s" y="%s">%s</text>\n'
+            % (class_name, _number(x), _number(y), escape(text))
+        )
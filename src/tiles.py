@@ -0,0 +1,296 @@
+import json
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cairocffi
+
+from .layout import Layout, LayoutText
+from .raster import RasterPrinter
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+
+VIEWER_TMPL = """<!DOCTYPE html>
+<html>
+<head>
+    <title>%s</title>
+    <meta charset="UTF-8">
+    <style type="text/css">
+        html, body { margin: 0; height: 100%%; overflow: hidden; background: #fff; }
+        #viewer { position: absolute; inset: 0; cursor: grab; }
+        #viewer img { position: absolute; image-rendering: auto; user-select: none; }
+    </style>
+</head>
+<body>
+    <div id="viewer"></div>
+    <script type="text/javascript">
+    var manifest = %s;
+    var viewer = document.getElementById("viewer");
+    var maxLevel = manifest.levels.length - 1;
+    // Scale of the view to the full size of the timeline, and its offset
+    var zoom = Math.min(1, viewer.clientWidth / manifest.width);
+    var offsetX = 0, offsetY = 0;
+    var tiles = {};
+
+    function render() {
+        var level = maxLevel + Math.ceil(Math.log2(zoom));
+        level = Math.max(0, Math.min(maxLevel, level));
+        var info = manifest.levels[level];
+        var size = manifest.tile_size * zoom / info.scale;
+        var firstCol = Math.max(0, Math.floor(-offsetX / size));
+        var firstRow = Math.max(0, Math.floor(-offsetY / size));
+        var lastCol = Math.floor((viewer.clientWidth - offsetX) / size);
+        var lastRow = Math.floor((viewer.clientHeight - offsetY) / size);
+        lastCol = Math.min(info.columns - 1, lastCol);
+        lastRow = Math.min(info.rows - 1, lastRow);
+        var visible = {};
+        for (var col = firstCol; col <= lastCol; col++) {
+            for (var row = firstRow; row <= lastRow; row++) {
+                var name = level + "/" + col + "_" + row + ".png";
+                visible[name] = true;
+                var img = tiles[name];
+                if (!img) {
+                    img = tiles[name] = document.createElement("img");
+                    img.src = name;
+                    img.draggable = false;
+                    viewer.appendChild(img);
+                }
+                img.style.left = (offsetX + col * size) + "px";
+                img.style.top = (offsetY + row * size) + "px";
+                img.style.width = img.style.height = (size + 0.5) + "px";
+            }
+        }
+        for (var name in tiles) {
+            if (!visible[name]) {
+                viewer.removeChild(tiles[name]);
+                delete tiles[name];
+            }
+        }
+    }
+
+    var dragging = null;
+    viewer.addEventListener("mousedown", function(e) {
+        dragging = {x: e.clientX - offsetX, y: e.clientY - offsetY};
+        viewer.style.cursor = "grabbing";
+    });
+    window.addEventListener("mouseup", function() {
+        dragging = null;
+        viewer.style.cursor = "grab";
+    });
+    window.addEventListener("mousemove", function(e) {
+        if (dragging) {
+            offsetX = e.clientX - dragging.x;
+            offsetY = e.clientY - dragging.y;
+            render();
+        }
+    });
+    viewer.addEventListener("wheel", function(e) {
+        e.preventDefault();
+        var factor = e.deltaY < 0 ? 1.25 : 0.8;
+        var newZoom = Math.max(Math.pow(2, -maxLevel), Math.min(4, zoom * factor));
+        offsetX = e.clientX - (e.clientX - offsetX) * newZoom / zoom;
+        offsetY = e.clientY - (e.clientY - offsetY) * newZoom / zoom;
+        zoom = newZoom;
+        render();
+    }, {passive: false});
+    window.addEventListener("resize", render);
+    render();
+    </script>
+</body>
+</html>"""
+
+
+# Rect of a shape of a layout, the size of labels being estimated as
+# BoundaryBox does
+def get_bounds(shape):
+    if isinstance(shape, LayoutText):
+        font_size = {"min": 10, "time": 5}.get(shape.class_name, 14)
+        width = len(shape.text) * font_size * 0.65
+        x = shape.x - width if shape.class_name == "right" else shape.x
+        return (x, shape.y - font_size, width, font_size)
+    return (shape.x, shape.y, shape.width, shape.height)
+
+
+# Shapes of a layout by tile of the full size, so that each of these tiles is
+# drawn from the shapes it intersects only
+class TileIndex:
+    def __init__(self, shapes, tile_size=TILE_SIZE):
+        self.shapes = shapes
+        self.tile_size = tile_size
+        self.buckets = {}
+
+        for index, shape in enumerate(shapes):
+            x, y, width, height = get_bounds(shape)
+            first_col = max(0, int(x // tile_size))
+            first_row = max(0, int(y // tile_size))
+            last_col = max(first_col, int((x + max(width, 0)) // tile_size))
+            last_row = max(first_row, int((y + max(height, 0)) // tile_size))
+            for col in range(first_col, last_col + 1):
+                for row in range(first_row, last_row + 1):
+                    self.buckets.setdefault((col, row), []).append(index)
+
+    # Shapes in the tile of the full size at (col, row), in drawing order
+    def get_shapes(self, col, row):
+        return tuple(self.shapes[index] for index in self.buckets.get((col, row), []))
+
+
+# Run in the worker processes
+def render_tile(layout, styles, view, scale, path):
+    RasterPrinter(layout, styles, view=view, scale=scale).print_png(path)
+    return path
+
+
+# Run in the worker processes: a tile drawn at half the size of the tiles of
+# the next level it covers, given as (path, column, row) in the tile. Tiles
+# past the end of the next level are left blank.
+def downsample_tile(children, path):
+    surface = cairocffi.ImageSurface(cairocffi.FORMAT_ARGB32, TILE_SIZE, TILE_SIZE)
+    context = cairocffi.Context(surface)
+    context.scale(0.5, 0.5)
+
+    for child_path, col, row in children:
+        child = cairocffi.ImageSurface.create_from_png(child_path)
+        context.set_source_surface(child, col * TILE_SIZE, row * TILE_SIZE)
+        context.paint()
+        child.finish()
+
+    try:
+        surface.write_to_png(path)
+    finally:
+        surface.finish()
+    return path
+
+
+# Render a layout as a pyramid of tiles of TILE_SIZE px, for a pan and zoom
+# viewer of timelines too big for one image: the last level is at full size,
+# each level before at half the size of the next one, down to a single tile.
+#
+# The tiles are rendered in a pool of processes, and at most a few of them are
+# pending at once, so that memory does not depend on the size of the layout:
+# - the tiles of the last level from a layout holding the shapes they
+#   intersect only,
+# - the tiles of the other levels by downsampling the four tiles of the next
+#   level they cover, once that level is written.
+#
+# output/
+#     index.html     viewer
+#     manifest.json  size of the timeline and of each level
+#     <level>/<column>_<row>.png
+class TilePrinter:
+    def __init__(self, layout, styles, title="", processes=None):
+        self.layout = layout
+        self.styles = styles
+        self.title = title
+        self.processes = processes or os.cpu_count() or 1
+
+    def get_manifest(self):
+        layout = self.layout
+        size = max(layout.width, layout.height, 1)
+        max_level = max(0, math.ceil(math.log2(size / TILE_SIZE)))
+
+        levels = []
+        for level in range(max_level + 1):
+            scale = 2 ** (level - max_level)
+            levels.append(
+                {
+                    "level": level,
+                    "scale": scale,
+                    "columns": max(1, math.ceil(layout.width * scale / TILE_SIZE)),
+                    "rows": max(1, math.ceil(layout.height * scale / TILE_SIZE)),
+                }
+            )
+
+        return {
+            "tile_size": TILE_SIZE,
+            "width": layout.width,
+            "height": layout.height,
+            "format": "png",
+            "levels": levels,
+        }
+
+    def __get_full_size_tiles(self, level_dir, level):
+        layout = self.layout
+        index = TileIndex(layout.shapes)
+
+        for col in range(level["columns"]):
+            for row in range(level["rows"]):
+                tile_layout = Layout(
+                    layout.width,
+                    layout.height,
+                    layout.grid,
+                    index.get_shapes(col, row),
+                    (),
+                    layout.lanes,
+                )
+                view = (col * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+                path = os.path.join(level_dir, "%d_%d.png" % (col, row))
+                yield (render_tile, tile_layout, self.styles, view, 1, path)
+
+    def __get_downsampled_tiles(self, level_dir, level, next_dir, next_level):
+        for col in range(level["columns"]):
+            for row in range(level["rows"]):
+                children = []
+                for child_col in (0, 1):
+                    for child_row in (0, 1):
+                        next_col = 2 * col + child_col
+                        next_row = 2 * row + child_row
+                        if (
+                            next_col < next_level["columns"]
+                            and next_row < next_level["rows"]
+                        ):
+                            child_path = os.path.join(
+                                next_dir, "%d_%d.png" % (next_col, next_row)
+                            )
+                            children.append((child_path, child_col, child_row))
+                path = os.path.join(level_dir, "%d_%d.png" % (col, row))
+                yield (downsample_tile, children, path)
+
+    # Run the tasks in the pool, a few at a time, until all are done
+    def __run(self, pool, tasks):
+        pending = set()
+        for function, *args in tasks:
+            if len(pending) >= 2 * self.processes:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(pool.submit(function, *args))
+        for future in wait(pending).done:
+            future.result()
+
+    def print_tiles(self, output):
+        manifest = self.get_manifest()
+        os.makedirs(output, exist_ok=True)
+
+        # The caller may run threads: do not fork the process
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=self.processes, mp_context=context
+        ) as pool:
+            # From the full size down, each level being drawn from the next one
+            next_dir = next_level = None
+            for level in reversed(manifest["levels"]):
+                level_dir = os.path.join(output, str(level["level"]))
+                os.makedirs(level_dir, exist_ok=True)
+
+                if next_level is None:
+                    tasks = self.__get_full_size_tiles(level_dir, level)
+                else:
+                    tasks = self.__get_downsampled_tiles(
+                        level_dir, level, next_dir, next_level
+                    )
+                self.__run(pool, tasks)
+                next_dir, next_level = level_dir, level
+
+        with open(os.path.join(output, "manifest.json"), "w") as f_manifest:
+            json.dump(manifest, f_manifest, indent=2)
+
+        with open(os.path.join(output, "index.html"), "w") as f_html:
+            f_html.write(VIEWER_TMPL % (self.title, json.dumps(manifest)))
+
+        logger.info(
+            "%d level(s) of tiles written to '%s'", len(manifest["levels"]), output
+        )
@@ -0,0 +1,66 @@
+import logging
+import random
+
+import urllib3
+
+logger = logging.getLogger(__name__)
+
+# Statuses of the responses retried, as sent by Jenkins or its proxies when
+# overloaded or restarting
+RETRY_STATUSES = [500, 502, 503, 504]
+
+
+# Full jitter on the exponential backoff, so that the workers hitting the same
+# error do not retry all at once
+class JitteredRetry(urllib3.Retry):
+    def get_backoff_time(self):
+        backoff = super(JitteredRetry, self).get_backoff_time()
+        return random.uniform(0, backoff)
+
+
+# HTTP access to Jenkins for BuildInfoFetcher:
+# - maxsize connections are kept per host, to match the fetch concurrency,
+# - contents are transferred compressed,
+# - requests are retried with jittered backoff on 5xx and connection errors,
+# - auth is a "user:token" string for basic auth, headers are added to all
+#   requests (e.g. {"Authorization": "Bearer ..."}).
+class HttpTransport:
+    def __init__(
+        self,
+        maxsize=10,
+        timeout=30.0,
+        retries=3,
+        backoff_factor=0.5,
+        auth=None,
+        headers=None,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+
+        self.headers = urllib3.make_headers(accept_encoding=True, basic_auth=auth)
+        if headers:
+            self.headers.update(headers)
+
+        self.retry = JitteredRetry(
+            total=retries,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=["GET"],
+            backoff_factor=backoff_factor,
+            raise_on_status=False,
+        )
+        self.pool_manager = urllib3.PoolManager(
+            maxsize=maxsize, timeout=timeout, retries=self.retry
+        )
+
+    def request(self, url, headers=None, preload_content=True):
+        request_headers = dict(self.headers)
+        if headers:
+            request_headers.update(headers)
+        return self.pool_manager.urlopen(
+            "GET", url, headers=request_headers, preload_content=preload_content
+        )
+
+    # Delay before the given retry (from 0), for clients not using urllib3
+    def get_backoff(self, attempt):
+        return random.uniform(0, self.backoff_factor * (2**attempt))
@@ -0,0 +1,190 @@
+import json
+import logging
+import re
+
+from .job_info import BuildInfo, BuildNotFoundException, SectionStore
+
+logger = logging.getLogger(__name__)
+
+
+# Find the stages and sub-builds of pipeline builds with the Pipeline REST API
+# (wfapi) instead of the console log:
+# - each stage of 'wfapi/describe' becomes a section of the build,
+# - the 'Build a job' steps of each stage give the sub-builds, from the log
+#   of that step only.
+# Parallel branches show up through the stages they contain, which the stage
+# view reports as flat stages.
+#
+# fetcher = BuildInfoFetcher(url, info_class=WorkflowApiBuildInfo)
+class WorkflowApiBuildInfo(BuildInfo):
+    build_step_name = "Build a job"
+    pattern = re.compile(
+        r"Starting building:.*?href=[\"'][^\"']*?/job/(?P<job>[^\"']+?)/(?P<bn>\d+)/"
+    )
+
+    def __init__(self, *args, **kwargs):
+        self.__described = False
+        self.__stage_sections = {}
+        # Stages and steps that will not change anymore
+        self.__done_stages = set()
+        self.__done_nodes = set()
+
+        super(WorkflowApiBuildInfo, self).__init__(*args, **kwargs)
+
+    def __get_json(self, extra):
+        with self._cache_lock(extra):
+            cache_key = self._cache_key(extra)
+            data = self._get_cached(cache_key)
+            if data is not None:
+                return data
+
+            raw_data, _, cache_key = self._fetch_build_data(extra, check_cache=False)
+            data = json.loads(raw_data)
+
+            if cache_key and self.is_done:
+                self._set_cached(cache_key, raw_data, data)
+
+        return data
+
+    # Content already in the cache or preloaded, without fetching it
+    def __peek_json(self, extra):
+        data = self._get_cached(self._cache_key(extra))
+        if data is not None:
+            return data
+
+        raw_data = self._preloaded.get(extra)
+        if isinstance(raw_data, BuildNotFoundException):
+            # Raised when described
+            return {}
+        if raw_data is not None:
+            return json.loads(raw_data)
+        return None
+
+    # Contents that __describe() needs and that are not available yet: the
+    # run first, then its stages, then the logs of their build steps
+    def _get_missing_contents(self):
+        if self.virtual or self.job_type != "pipeline" or self.__described:
+            return []
+
+        run = self.__peek_json("wfapi/describe")
+        if run is None:
+            return ["wfapi/describe"]
+
+        missing = []
+        for stage in run.get("stages", []):
+            if stage["id"] in self.__done_stages:
+                continue
+
+            extra = "execution/node/%s/wfapi/describe" % stage["id"]
+            stage_info = self.__peek_json(extra)
+            if stage_info is None:
+                missing.append(extra)
+                continue
+
+            for node in stage_info.get("stageFlowNodes", []):
+                if (
+                    node["id"] in self.__done_nodes
+                    or node.get("name") != self.build_step_name
+                ):
+                    continue
+                extra = "execution/node/%s/wfapi/log" % node["id"]
+                if self.__peek_json(extra) is None:
+                    missing.append(extra)
+        return missing
+
+    def __describe(self):
+        self.__described = True
+
+        if self._sub_builds is None:
+            self._sub_builds = []
+        if self._sections is None:
+            self._sections = SectionStore()
+
+        run = self.__get_json("wfapi/describe")
+
+        for stage in run.get("stages", []):
+            stage_id = stage["id"]
+            in_progress = stage.get("status") == "IN_PROGRESS"
+
+            index = self.__stage_sections.get(stage_id)
+            if index is None:
+                index = self._sections.add(stage["name"])
+                self.__stage_sections[stage_id] = index
+            section = self._sections[index]
+            section.start = stage.get("startTimeMillis")
+            if not in_progress and section.start:
+                section.end = section.start + stage.get("durationMillis", 0)
+
+            if stage_id in self.__done_stages:
+                continue
+
+            self.__describe_stage(stage)
+
+            if not in_progress:
+                self.__done_stages.add(stage_id)
+
+    def __describe_stage(self, stage):
+        stage_info = self.__get_json("execution/node/%s/wfapi/describe" % stage["id"])
+
+        for node in stage_info.get("stageFlowNodes", []):
+            node_id = node["id"]
+            if node_id in self.__done_nodes:
+                continue
+
+            in_progress = node.get("status") == "IN_PROGRESS"
+            if node.get("name") != self.build_step_name:
+                if not in_progress:
+                    self.__done_nodes.add(node_id)
+                continue
+
+            node_log = self.__get_json("execution/node/%s/wfapi/log" % node_id)
+
+            found = False
+            for match in self.pattern.finditer(node_log.get("text") or ""):
+                job_name = match.group("job")
+                build_number = match.group("bn")
+                logger.debug(
+                    "Sub-build: %s#%s [%s]", job_name, build_number, stage["name"]
+                )
+                self.create_sub_build(job_name, build_number, stage["name"])
+                found = True
+
+            # The sub-build may not have been started yet
+            if found or not in_progress:
+                self.__done_nodes.add(node_id)
+
+    def _needs_log_parsing(self):
+        if self.job_type == "pipeline":
+            return False
+        return super(WorkflowApiBuildInfo, self)._needs_log_parsing()
+
+    def _fetch_sub_builds(self):
+        if self.virtual or self.job_type != "pipeline":
+            super(WorkflowApiBuildInfo, self)._fetch_sub_builds()
+            return
+
+        self.__describe()
+
+        logger.info(
+            "%s#%s (%s): %d sub-build(s)",
+            self.job_name,
+            self.build_number,
+            self.job_type,
+            len(self._sub_builds),
+        )
+
+    def _determine_sections(self):
+        if self.virtual or self.job_type != "pipeline":
+            super(WorkflowApiBuildInfo, self)._determine_sections()
+            return
+
+        if not self.__described:
+            self.__describe()
+
+    def _refresh_content(self):
+        if self.virtual or self.job_type != "pipeline":
+            super(WorkflowApiBuildInfo, self)._refresh_content()
+            return
+
+        # Only the stages and steps in progress are described again
+        self.__describe()
@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from src.cache import MemoryCache
+from src.job_info import BuildInfoFetcher
+from src.server import BuildRenderer, RequestHandler
+
+START = 1700000000000
+
+
+def freestyle_build(number, sections):
+    info = {
+        "_class": "hudson.model.FreeStyleBuild",
+        "number": number,
+        "timestamp": START,
+        "duration": 200000,
+        "building": False,
+        "result": "SUCCESS",
+        "description": None,
+        "builtOn": "node",
+        "actions": [],
+    }
+    lines = []
+    for index, name in enumerate(sections):
+        time_s = START // 1000 + 10 * index
+        lines.append("[section:%s] start time=%d" % (name, time_s + 1))
+        lines.append("[section:%s] end time=%d" % (name, time_s + 9))
+    return {"api/json": json.dumps(info), "consoleText": "\n".join(lines) + "\n"}
+
+
+# Jenkins serving the builds of 'job', by number or permalink, after a delay
+class JenkinsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        with self.server.lock:
+            self.server.requests.append(path)
+        self.server.requested.set()
+        time.sleep(self.server.delay)
+
+        _, _, build, content = path.strip("/").split("/", 3)
+        body = self.server.builds.get(build, {}).get(content)
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/" % server.server_address[1]
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.jenkins, jenkins_url = start_server(JenkinsHandler)
+        self.jenkins.lock = threading.Lock()
+        self.jenkins.requests = []
+        self.jenkins.requested = threading.Event()
+        self.jenkins.delay = 0.0
+        self.jenkins.builds = {
+            "7": freestyle_build(7, ["checkout", "build"]),
+            "8": freestyle_build(8, ["checkout", "build", "test"]),
+        }
+        self.jenkins.builds["lastCompletedBuild"] = self.jenkins.builds["7"]
+
+        cache = MemoryCache()
+        self.printers = []
+        self.renderer = BuildRenderer(
+            lambda: BuildInfoFetcher(jenkins_url, cache=cache, cache_ttl=None),
+            configure=self.printers.append,
+            concurrency=2,
+            timeout=5.0,
+        )
+        self.server, self.url = start_server(RequestHandler)
+        self.server.renderer = self.renderer
+
+    def tearDown(self):
+        for server in [self.server, self.jenkins]:
+            server.shutdown()
+            server.server_close()
+
+    def get(self, build, output_format="svg"):
+        url = "%sjob/job/%s.%s" % (self.url, build, output_format)
+        try:
+            with urlopen(url) as response:
+                return (response.status, response.read())
+        except HTTPError as ex:
+            return (ex.code, ex.read())
+
+    # Responses of concurrent requests of (build, format)
+    def get_all(self, outputs):
+        responses = [None] * len(outputs)
+
+        def get(index):
+            responses[index] = self.get(*outputs[index])
+
+        threads = [threading.Thread(target=get, args=(i,)) for i in range(len(outputs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def requests(self, content="api/json"):
+        return [path for path in self.jenkins.requests if path.endswith(content)]
+
+    def test_concurrent_requests_fetch_once(self):
+        self.jenkins.delay = 0.2
+
+        # Outputs of the same build are rendered separately, from one fetch
+        responses = self.get_all([("7", "svg"), ("7", "html")] * 4)
+
+        self.assertEqual({status for status, _ in responses}, {200})
+        self.assertEqual(len({content for _, content in responses}), 2)
+        self.assertEqual(self.requests(), ["/job/job/7/api/json"])
+        self.assertEqual(self.requests("consoleText"), ["/job/job/7/consoleText"])
+
+    def test_busy(self):
+        self.renderer = BuildRenderer(
+            self.renderer.create_fetcher, concurrency=1, timeout=0.1
+        )
+        self.server.renderer = self.renderer
+        self.jenkins.delay = 0.5
+
+        first = []
+        thread = threading.Thread(target=lambda: first.append(self.get("7")))
+        thread.start()
+        self.jenkins.requested.wait(5)
+        status, _ = self.get("8")
+        thread.join()
+
+        self.assertEqual(first[0][0], 200)
+        self.assertEqual(status, 503)
+        self.assertEqual(self.get("8")[0], 200)
+
+    def test_output_cached(self):
+        status, content = self.get("7")
+        self.assertEqual(status, 200)
+        self.assertIn(b"<svg", content)
+
+        del self.jenkins.requests[:]
+        self.assertEqual(self.get("7"), (200, content))
+        self.assertEqual(self.jenkins.requests, [])
+        self.assertEqual(len(self.printers), 1)
+
+    def test_permalink_not_cached(self):
+        status, content = self.get("lastCompletedBuild")
+        self.assertEqual(status, 200)
+        self.assertEqual(self.get("7"), (200, content))
+
+        self.jenkins.builds["lastCompletedBuild"] = self.jenkins.builds["8"]
+        del self.jenkins.requests[:]
+        status, content = self.get("lastCompletedBuild")
+
+        self.assertEqual(status, 200)
+        self.assertEqual(self.requests(), ["/job/job/lastCompletedBuild/api/json"])
+        self.assertEqual(len(self.printers), 3)
+        self.assertEqual(self.get("8"), (200, content))
+        self.assertNotEqual(self.get("7")[1], content)
+
+
+if __name__ == "__main__":
+    unittest.main()